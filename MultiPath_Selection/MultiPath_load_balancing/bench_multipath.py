@@ -0,0 +1,380 @@
+#!/usr/bin/python3
+
+'''
+Benchmark the multipath controllers' path computation without switches.
+
+The Controller13 apps are built directly, and self.neigh and the link
+metrics in self.state are filled in from a generated topology:
+
+  fattree:K           K-ary fat-tree (5K^2/4 switches, hosts on edge switches)
+  leafspine:L:S       L leaf and S spine switches (hosts on leaves)
+  random:N:D          N switches, connected, about D links per switch
+
+Fake datapaths serialize what they're sent (so building flow mods counts);
+nothing is scheduled, since no switch ever enters.  For a few
+host pairs per topology it times find_paths_and_costs, find_n_optimal_paths,
+install_paths (the first call for a pair, which computes its paths, and a
+later one), sending the rules they queued (see flow_programmer) and the
+PacketIn handler for a TCP packet between them.  No barrier replies come
+back, so PacketOuts are never sent.
+
+With --precompute, the routes between all the switches with hosts are
+worked out first (see route_precompute), so install_paths looks them up.
+--proactive (with --precompute) has the controllers put in per-destination
+rules instead (FORWARDING in multipath), so install_paths_first is the time
+to set up forwarding to a host on every switch.
+
+Each call is given --time-limit seconds, so a search that blows up (like
+the old one listing every simple path) can't hang the run; after a timeout
+the rest of that topology is skipped.
+
+Run it from this directory with Ryu and NumPy installed, e.g.:
+  python3 bench_multipath.py --topos fattree:4,leafspine:16:4 --json out.json
+'''
+
+import argparse
+import json
+import logging
+import random
+import signal
+import statistics
+import struct
+import time
+
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import tcp
+from ryu.lib.packet import ether_types
+from ryu.ofproto import inet
+
+import multipath
+import route_precompute
+import multipathWithLatencyCost
+import multipathWithBWCost
+
+CONTROLLERS = {
+    'latency': multipathWithLatencyCost.Controller13,
+    'bw': multipathWithBWCost.Controller13,
+    'combined': multipath.Controller13,
+}
+
+DEFAULT_TOPOS = 'fattree:4,fattree:8,leafspine:16:4,leafspine:48:8,random:50:3,random:300:4'
+
+
+class Timeout(Exception):
+    pass
+
+
+class FakeDatapath:
+    def __init__(self, dpid, serialize=True):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.serialize = serialize
+        self.xid = 0
+        self.sent = 0
+        self.writes = 0
+        self.bytes = 0
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        # Like Datapath.send_msg()
+        self.set_xid(msg)
+        if self.serialize:
+            msg.serialize()
+            self.bytes += len(msg.buf)
+        self.sent += 1
+        self.writes += 1
+
+    def send(self, buf):
+        # A batch from the flow programmer: count the messages in it
+        offset = 0
+        while offset < len(buf):
+            offset += struct.unpack_from('!H', buf, offset + 2)[0]
+            self.sent += 1
+        self.bytes += len(buf)
+        self.writes += 1
+
+
+class Topology:
+    ''' Switch graph with port numbers, plus where the hosts are '''
+
+    def __init__(self, name):
+        self.name = name
+        self.neigh = {}  # dpid -> {neighbour dpid: port}
+        self.next_port = {}
+        self.hosts = {}  # MAC -> (dpid, port)
+        self.host_ips = {}  # MAC -> IP
+
+    def add_switch(self, dpid):
+        self.neigh[dpid] = {}
+        self.next_port[dpid] = 1
+
+    def _port(self, dpid):
+        port = self.next_port[dpid]
+        self.next_port[dpid] += 1
+        return port
+
+    def add_link(self, a, b):
+        if b in self.neigh[a] or a == b:
+            return
+        self.neigh[a][b] = self._port(a)
+        self.neigh[b][a] = self._port(b)
+
+    def add_host(self, dpid):
+        n = len(self.hosts) + 1
+        mac = '00:00:00:%02x:%02x:%02x' % (n >> 16, (n >> 8) & 0xff, n & 0xff)
+        self.hosts[mac] = (dpid, self._port(dpid))
+        self.host_ips[mac] = '10.%i.%i.%i' % (n >> 16, (n >> 8) & 0xff, n & 0xff)
+
+    @property
+    def links(self):
+        return sum(len(n) for n in self.neigh.values()) // 2
+
+
+def fat_tree(k):
+    t = Topology(f'fattree:{k}')
+    half = k // 2
+    core = list(range(1, half * half + 1))
+    dpid = len(core) + 1
+    for s in core:
+        t.add_switch(s)
+    for pod in range(k):
+        aggs = list(range(dpid, dpid + half))
+        edges = list(range(dpid + half, dpid + k))
+        dpid += k
+        for s in aggs + edges:
+            t.add_switch(s)
+        for i, agg in enumerate(aggs):
+            for j in range(half):
+                t.add_link(agg, core[i * half + j])
+            for edge in edges:
+                t.add_link(agg, edge)
+        for edge in edges:
+            for _ in range(half):
+                t.add_host(edge)
+    return t
+
+
+def leaf_spine(leaves, spines):
+    t = Topology(f'leafspine:{leaves}:{spines}')
+    for s in range(1, leaves + spines + 1):
+        t.add_switch(s)
+    for leaf in range(1, leaves + 1):
+        for spine in range(leaves + 1, leaves + spines + 1):
+            t.add_link(leaf, spine)
+        t.add_host(leaf)
+    return t
+
+
+def random_graph(n, degree, rng):
+    t = Topology(f'random:{n}:{degree}')
+    for s in range(1, n + 1):
+        t.add_switch(s)
+    # A random spanning tree keeps it connected...
+    for s in range(2, n + 1):
+        t.add_link(s, rng.randint(1, s - 1))
+    # ...then random extra links up to the degree
+    while t.links < n * degree // 2:
+        t.add_link(rng.randint(1, n), rng.randint(1, n))
+    for s in range(1, n + 1):
+        t.add_host(s)
+    return t
+
+
+def make_topology(spec, rng):
+    kind, *args = spec.split(':')
+    args = [int(a) for a in args]
+    if kind == 'fattree':
+        return fat_tree(*args)
+    if kind == 'leafspine':
+        return leaf_spine(*args)
+    if kind == 'random':
+        return random_graph(*args, rng)
+    raise ValueError(f'Unknown topology {spec}')
+
+
+def make_controller(cls, topo, rng, serialize):
+    app = cls()
+    for dpid, neigh in topo.neigh.items():
+        app.datapath_list[dpid] = FakeDatapath(dpid, serialize)
+        app.switches.append(dpid)
+        for other, port in neigh.items():
+            app.neigh[dpid][other] = port
+            # Made-up measurements
+            link = app.state.link_id(dpid, port)
+            app.state.latency[link] = rng.uniform(0.001, 0.010)
+            app.state.rate[link] = rng.uniform(0.0, 100.0)
+            app.state.loss[link] = rng.choice((0.0, 0.0, 0.01))
+            app.state.capacity[link] = rng.choice((100.0, 1000.0))
+    app.state.changed()
+    app.hosts.update(topo.hosts)
+    for mac, ip in topo.host_ips.items():
+        app.arp_table[ip] = mac
+    return app
+
+
+def tcp_packet_in(datapath, in_port, src_mac, dst_mac, src_ip, dst_ip, sport):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_IP,
+                                       dst=dst_mac, src=src_mac))
+    pkt.add_protocol(ipv4.ipv4(proto=inet.IPPROTO_TCP, src=src_ip, dst=dst_ip))
+    pkt.add_protocol(tcp.tcp(src_port=sport, dst_port=80, bits=tcp.TCP_SYN))
+    pkt.serialize()
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, buffer_id=datapath.ofproto.OFP_NO_BUFFER,
+                             total_len=len(pkt.data), reason=0, table_id=0,
+                             cookie=0, match=parser.OFPMatch(in_port=in_port),
+                             data=pkt.data)
+    msg.msg_len = len(pkt.data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+
+def _alarm(signum, frame):
+    raise Timeout()
+
+
+def timed(limit, fn, *args):
+    ''' (seconds, result) of fn(*args); raises Timeout after limit seconds '''
+    signal.setitimer(signal.ITIMER_REAL, limit)
+    try:
+        start = time.perf_counter()
+        result = fn(*args)
+        return time.perf_counter() - start, result
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+STEPS = ('precompute', 'find_paths_and_costs', 'find_n_optimal_paths',
+         'install_paths_first', 'install_paths', 'flush', 'packet_in')
+
+
+def bench_topology(name, cls, topo, pairs, limit, rng, serialize, precompute=False):
+    app = make_controller(cls, topo, rng, serialize)
+    times = {step: [] for step in STEPS}
+    result = {'controller': name, 'topology': topo.name,
+              'switches': len(topo.neigh), 'links': topo.links,
+              'timeout': None, 'paths': []}
+
+    macs = list(topo.hosts)
+    chosen = []
+    while len(chosen) < pairs and len(macs) > 1:
+        a, b = rng.sample(macs, 2)
+        if topo.hosts[a][0] != topo.hosts[b][0]:
+            chosen.append((a, b))
+
+    step = None
+    try:
+        if precompute:
+            step = 'precompute'
+            t, app.routes = timed(limit, route_precompute.compute_routes, app.route_job())
+            times[step].append(t)
+            result['precomputed_pairs'] = len(app.routes)
+
+        for n, (a, b) in enumerate(chosen):
+            (s1, p1), (s2, p2) = topo.hosts[a], topo.hosts[b]
+            ip1, ip2 = topo.host_ips[a], topo.host_ips[b]
+
+            step = 'find_paths_and_costs'
+            t, paths = timed(limit, app.find_paths_and_costs, s1, s2)
+            times[step].append(t)
+            result['paths'].append(len(paths))
+
+            step = 'find_n_optimal_paths'
+            t, _ = timed(limit, app.find_n_optimal_paths, paths)
+            times[step].append(t)
+
+            ev = tcp_packet_in(app.datapath_list[s1], p1, a, b, ip1, ip2, 1024 + n)
+            pkt = packet.Packet(ev.msg.data)
+            step = 'install_paths_first'
+            t, _ = timed(limit, app.install_paths, s1, p1, s2, p2, ip1, ip2, 'TCP', pkt)
+            times[step].append(t)
+            step = 'install_paths'
+            t, _ = timed(limit, app.install_paths, s1, p1, s2, p2, ip1, ip2, 'TCP', pkt)
+            times[step].append(t)
+            step = 'flush'
+            t, _ = timed(limit, app.flow_programmer.flush)
+            times[step].append(t)
+
+            step = 'packet_in'
+            t, _ = timed(limit, app._packet_in_handler, ev)
+            times[step].append(t)
+    except Timeout:
+        result['timeout'] = step
+
+    for step, ts in times.items():
+        result[step] = {'calls': len(ts),
+                        'median': statistics.median(ts) if ts else None,
+                        'max': max(ts) if ts else None}
+    result['messages'] = sum(dp.sent for dp in app.datapath_list.values())
+    result['writes'] = sum(dp.writes for dp in app.datapath_list.values())
+    return result
+
+
+def print_result(r):
+    print(f"{r['controller']:8} {r['topology']:16} {r['switches']:4} switches "
+          f"{r['links']:5} links" + (f"  (timed out in {r['timeout']})" if r['timeout'] else ''))
+    for step in STEPS:
+        s = r[step]
+        if s['calls']:
+            print(f"    {step:22} median {s['median'] * 1000:10.3f} ms  "
+                  f"max {s['max'] * 1000:10.3f} ms  ({s['calls']} calls)")
+    if r.get('precomputed_pairs'):
+        print(f"    precomputed switch pairs: {r['precomputed_pairs']}")
+    if r['paths']:
+        print(f"    paths per pair: {statistics.median(r['paths']):.0f} (median)")
+    print(f"    messages to switches: {r['messages']} in {r['writes']} writes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topos', default=DEFAULT_TOPOS,
+                        help="Comma-separated topologies (see above)")
+    parser.add_argument('--controllers', default='latency,bw,combined')
+    parser.add_argument('--pairs', type=int, default=5, help="Host pairs per topology")
+    parser.add_argument('--time-limit', type=float, default=10.0,
+                        help="Seconds allowed for any one call")
+    parser.add_argument('--no-serialize', action='store_true',
+                        help="Don't serialize the messages sent to switches")
+    parser.add_argument('--precompute', action='store_true',
+                        help="Precompute the routes between all host switches first")
+    parser.add_argument('--proactive', action='store_true',
+                        help="Per-destination rules on every switch (needs --precompute)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Save the results to this file")
+    args = parser.parse_args()
+    if args.proactive:
+        if not args.precompute:
+            parser.error("--proactive needs --precompute")
+        multipath.FORWARDING = 'proactive'
+
+    logging.getLogger().setLevel(logging.WARNING)
+    signal.signal(signal.SIGALRM, _alarm)
+
+    results = []
+    for name in args.controllers.split(','):
+        for spec in args.topos.split(','):
+            rng = random.Random(args.seed)
+            topo = make_topology(spec, rng)
+            r = bench_topology(name, CONTROLLERS[name], topo, args.pairs,
+                               args.time_limit, rng, not args.no_serialize,
+                               args.precompute)
+            print_result(r)
+            results.append(r)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
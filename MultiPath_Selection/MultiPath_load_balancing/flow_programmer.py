@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+'''
+Flow and group mods for the switches, sent in batches with barriers.
+
+Instead of one send_msg per rule, the controller queues its mods here and
+flushes them once it's done handling an event.  Per switch, a mod for the
+same rule (table, priority and match) or the same group as a pending one
+replaces it, so installing both directions of a pair, or the same
+destination again, only sends each rule once.  The mods are serialized
+together and written BATCH_SIZE at a time, with an OFPBarrierRequest
+after the last one; the barrier reply says the switch has them all.
+
+PacketOuts wait here too: a packet held with packet_out() is only sent
+once the barriers of the batches flushed with it have come back, so it
+can't get to a switch before its rules do (and come back as another
+PacketIn).  A flush with no mods sends its packets straight away, and
+expire() (run every so often) lets out packets that have waited longer
+than WAIT_TIMEOUT for a switch that doesn't answer.  The time from a
+switch's batch to its barrier reply is its install latency, kept per
+switch.
+
+  programmer.flow_mod(dp, parser.OFPFlowMod(...))
+  programmer.packet_out(dp, parser.OFPPacketOut(...))
+  programmer.flush()
+  ...
+  programmer.barrier_reply(dpid, xid)  # from the EventOFPBarrierReply handler
+  programmer.expire()  # every WAIT_TIMEOUT or so
+'''
+
+import logging
+import time
+from collections import defaultdict
+
+BATCH_SIZE = 64  # Messages per write to a switch
+EWMA_ALPHA = 0.2  # Weight of the newest install latency
+WAIT_TIMEOUT = 1.0  # Seconds a PacketOut waits for barriers at most
+
+
+def _ewma(old, new, alpha):
+    return new if old is None else old + alpha * (new - old)
+
+
+class FlowProgrammer:
+    def __init__(self, batch_size=BATCH_SIZE, alpha=EWMA_ALPHA,
+                 timeout=WAIT_TIMEOUT, clock=time.monotonic, logger=None):
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.timeout = timeout
+        self.clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.pending = {}  # dpid -> (datapath, {rule or group key: mod}, in order)
+        self.held = []  # (datapath, PacketOut) until the next flush
+        self.barriers = {}  # (dpid, xid) -> (time sent, mods)
+        # [time flushed, set of (dpid, xid) still to come, [(datapath, PacketOut)]]
+        self.waiting = []
+        self.latency = {}  # dpid -> install latency in seconds (EWMA)
+        self.installed = defaultdict(int)  # dpid -> mods confirmed
+
+    def _queue(self, datapath, key, mod):
+        _, mods = self.pending.setdefault(datapath.id, (datapath, {}))
+        mods[key] = mod
+
+    def flow_mod(self, datapath, mod):
+        ''' Queue an OFPFlowMod, replacing a pending one for the same rule '''
+        key = ('flow', mod.table_id, mod.priority, tuple(mod.match.items()))
+        self._queue(datapath, key, mod)
+
+    def group_mod(self, datapath, mod):
+        ''' Queue an OFPGroupMod, replacing a pending one for the same group '''
+        key = ('group', mod.group_id)
+        current = self.pending.get(datapath.id, (None, {}))[1].get(key)
+        if current is not None and current.command == datapath.ofproto.OFPGC_ADD:
+            # The switch hasn't got the group yet
+            mod.command = current.command
+        self._queue(datapath, key, mod)
+
+    def packet_out(self, datapath, msg):
+        ''' Send a PacketOut once the rules flushed with it are in '''
+        self.held.append((datapath, msg))
+
+    def flush(self):
+        ''' Send everything queued, a batch and a barrier per switch '''
+        now = self.clock()
+        sent = set()
+        for dpid, (datapath, mods) in self.pending.items():
+            xid = self._send(datapath, list(mods.values()))
+            self.barriers[(dpid, xid)] = (now, len(mods))
+            sent.add((dpid, xid))
+        self.pending = {}
+        if self.held:
+            if sent:
+                # Only this flush's barriers
+                self.waiting.append([now, sent, self.held])
+            else:
+                self._send_packets(self.held)
+            self.held = []
+
+    def _send(self, datapath, msgs):
+        ''' Write msgs and a barrier batch_size at a time; returns the barrier's xid '''
+        barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+        msgs.append(barrier)
+        for start in range(0, len(msgs), self.batch_size):
+            buf = bytearray()
+            for msg in msgs[start:start + self.batch_size]:
+                datapath.set_xid(msg)
+                msg.serialize()
+                buf += msg.buf
+            datapath.send(bytes(buf))
+        return barrier.xid
+
+    def barrier_reply(self, dpid, xid):
+        '''
+        A switch has everything up to this barrier; returns (mods, install
+        latency) for the batch, or None if it isn't one of ours
+        '''
+        sent = self.barriers.pop((dpid, xid), None)
+        if sent is None:
+            return None
+        sent_time, mods = sent
+        latency = self.clock() - sent_time
+        self.latency[dpid] = _ewma(self.latency.get(dpid), latency, self.alpha)
+        self.installed[dpid] += mods
+        self._release((dpid, xid))
+        return mods, latency
+
+    @staticmethod
+    def _send_packets(packets):
+        for datapath, msg in packets:
+            datapath.send_msg(msg)
+
+    def _release(self, barrier):
+        still_waiting = []
+        for entry in self.waiting:
+            entry[1].discard(barrier)
+            if entry[1]:
+                still_waiting.append(entry)
+            else:
+                self._send_packets(entry[2])
+        self.waiting = still_waiting
+
+    def expire(self):
+        '''
+        Send packets that have waited more than timeout for their barriers,
+        and forget those barriers
+        '''
+        limit = self.clock() - self.timeout
+        still_waiting = []
+        for entry in self.waiting:
+            if entry[0] > limit:
+                still_waiting.append(entry)
+                continue
+            self.logger.warning(f"No barrier reply from switches {sorted({d for d, x in entry[1]})} "
+                                f"in {self.timeout} s; sending {len(entry[2])} packets anyway")
+            self._send_packets(entry[2])
+        self.waiting = still_waiting
+        for barrier in [b for b, (t, _) in self.barriers.items() if t <= limit]:
+            del self.barriers[barrier]
+
+    def switch_removed(self, dpid):
+        ''' Forget a switch that's gone; packets waiting for it go out anyway '''
+        self.pending.pop(dpid, None)
+        self.held = [(dp, msg) for dp, msg in self.held if dp.id != dpid]
+        for entry in self.waiting:
+            entry[2] = [(dp, msg) for dp, msg in entry[2] if dp.id != dpid]
+        for barrier in [b for b in self.barriers if b[0] == dpid]:
+            del self.barriers[barrier]
+            self._release(barrier)
+        self.latency.pop(dpid, None)
+        self.installed.pop(dpid, None)
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+'''
+The switch graph in flat arrays, for working over thousands of links.
+
+Graph.build() takes the controllers' neigh table (dpid -> {neighbour dpid:
+port}) and gives each switch a dense index, with the links out of switch i
+at edges indptr[i]:indptr[i + 1] (CSR):
+
+  indices[e]   index of the switch at the other end
+  links[e]     the link's NetworkState id (see network_state)
+  reverse[e]   the edge going the other way, or -1
+
+so a vector of every link's cost (by link id) becomes the edges' costs with
+one gather, costs[graph.links].  A batch of paths (lists of dpids) can be
+costed the same way: path_sums() and path_mins() look up all their links
+and add up (or take the narrowest of) each path's in one go.
+
+A Graph doesn't change; build a new one when the topology does.
+'''
+
+import heapq
+
+import numpy as np
+
+INF = float('inf')
+
+
+class Graph:
+    def __init__(self):
+        self.dpids = []  # index -> dpid
+        self.index = {}  # dpid -> index
+        self.edge = {}  # (dpid, dpid) -> edge
+        self.indptr = np.zeros(1, dtype=np.intp)
+        self.indices = np.zeros(0, dtype=np.intp)
+        self.links = np.zeros(0, dtype=np.intp)
+        self.reverse = np.zeros(0, dtype=np.intp)
+        self._lists = None
+
+    @classmethod
+    def build(cls, neigh, link_id):
+        ''' link_id(dpid, port) gives the NetworkState id of a link '''
+        g = cls()
+        g.dpids = sorted(set(neigh) | {v for n in neigh.values() for v in n})
+        g.index = {dpid: i for i, dpid in enumerate(g.dpids)}
+        indptr = [0]
+        indices = []
+        links = []
+        for u in g.dpids:
+            for v, port in sorted(neigh.get(u, {}).items()):
+                g.edge[u, v] = len(indices)
+                indices.append(g.index[v])
+                links.append(link_id(u, port))
+            indptr.append(len(indices))
+        g.indptr = np.array(indptr, dtype=np.intp)
+        g.indices = np.array(indices, dtype=np.intp)
+        g.links = np.array(links, dtype=np.intp)
+        g.reverse = np.array([g.edge.get((v, u), -1) for u, v in g.edge],
+                             dtype=np.intp)
+        return g
+
+    def __len__(self):
+        return len(self.dpids)
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    def lists(self):
+        ''' indptr and indices as lists, for the searches in pure Python '''
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist())
+        return self._lists
+
+    def edge_costs(self, link_costs):
+        ''' Cost of each edge, from the cost of each link (by link id) '''
+        return np.asarray(link_costs)[self.links]
+
+    def reverse_costs(self, edge_costs):
+        ''' Edge costs of the graph with every link turned round '''
+        if not len(self.reverse):
+            return np.zeros(0)
+        return np.where(self.reverse >= 0, edge_costs[self.reverse], INF)
+
+    def distances(self, src, edge_costs):
+        '''
+        Cost of the cheapest path from src to each switch it can reach
+
+        For the cost of the cheapest path *to* src, give reverse_costs().
+        '''
+        start = self.index.get(src)
+        if start is None:
+            return {}
+        indptr, indices = self.lists()
+        costs = np.asarray(edge_costs, dtype=float).tolist()
+        dist = {}
+        heap = [(0.0, start)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in dist:
+                continue
+            dist[u] = d
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                if v not in dist:
+                    heapq.heappush(heap, (d + costs[e], v))
+        dpids = self.dpids
+        return {dpids[i]: d for i, d in dist.items()}
+
+    def path_links(self, paths):
+        '''
+        (link ids, which path each is in) for all the links of the paths
+        '''
+        edge = self.edge
+        edges = []
+        owners = []
+        for n, path in enumerate(paths):
+            for hop in zip(path[:-1], path[1:]):
+                edges.append(edge[hop])
+                owners.append(n)
+        return (self.links[np.array(edges, dtype=np.intp)],
+                np.array(owners, dtype=np.intp))
+
+    def path_sums(self, paths, link_values):
+        ''' Total of link_values (by link id) along each path '''
+        links, owners = self.path_links(paths)
+        return np.bincount(owners, weights=np.asarray(link_values)[links],
+                           minlength=len(paths))
+
+    def path_mins(self, paths, link_values, empty=0.0):
+        ''' Smallest of link_values along each path (empty for no links) '''
+        links, owners = self.path_links(paths)
+        mins = np.full(len(paths), INF)
+        np.minimum.at(mins, owners, np.asarray(link_values)[links])
+        mins[mins == INF] = empty
+        return mins
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+'''
+One-way latency of the links between switches, measured with probes.
+
+Timing a stats request only measures the controller <-> switch channel,
+which is the same for every port of a switch.  Instead, for each link the
+controller sends a probe frame (its own ethertype, carrying where it was
+sent from and when) out of one switch with a PacketOut, and the switch at
+the other end sends it back in a PacketIn.  The time in between is
+
+  controller -> switch A -> link -> switch B -> controller
+
+so half of each switch's echo round trip (OFPEchoRequest, measured the same
+way) is taken off to leave the link.  Both the echo round trips and the
+link latencies are smoothed with an EWMA, since single probes are noisy.
+
+Each switch needs a rule sending probes to the controller (catch_probes()),
+so they aren't matched by anything else.  Latencies are in seconds and kept
+per (dpid, port) the probe went out of.
+'''
+
+import struct
+import time
+
+ETH_TYPE_PROBE = 0x88b6  # IEEE 802 local experimental ethertype
+PROBE_DST = b'\x01\x80\xc2\x00\x00\x0e'  # Link-local, bridges don't forward it
+PROBE_SRC = b'\x02\x00\x00\x00\x00\x01'
+PROBE_FORMAT = '!QId'  # dpid, port, time sent
+ECHO_FORMAT = '!4sd'  # tag, time sent
+ECHO_TAG = b'lprb'  # Tells our echo replies from anyone else's
+PROBE_PRIORITY = 65000
+EWMA_ALPHA = 0.2  # Weight of a new sample
+
+
+def _ewma(old, new, alpha):
+    return new if old is None else old + alpha * (new - old)
+
+
+class LinkLatency:
+    def __init__(self, alpha=EWMA_ALPHA, clock=time.monotonic):
+        self.alpha = alpha
+        self.clock = clock
+        self.echo_rtt = {}  # dpid -> smoothed echo round trip
+        self.links = {}  # (dpid, port) -> smoothed one-way latency
+
+    def catch_probes(self, datapath, add_flow):
+        ''' Install the rule sending probes to the controller '''
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type=ETH_TYPE_PROBE)
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        add_flow(datapath, PROBE_PRIORITY, match, actions, 0)
+
+    def send_echo(self, datapath):
+        parser = datapath.ofproto_parser
+        data = struct.pack(ECHO_FORMAT, ECHO_TAG, self.clock())
+        datapath.send_msg(parser.OFPEchoRequest(datapath, data=data))
+
+    def echo_reply(self, dpid, data):
+        ''' An echo reply came; returns the switch's smoothed round trip '''
+        if len(data) != struct.calcsize(ECHO_FORMAT):
+            return None
+        tag, sent = struct.unpack(ECHO_FORMAT, data)
+        if tag != ECHO_TAG:
+            return None
+        rtt = self.clock() - sent
+        self.echo_rtt[dpid] = _ewma(self.echo_rtt.get(dpid), rtt, self.alpha)
+        return self.echo_rtt[dpid]
+
+    def send_probe(self, datapath, port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        frame = PROBE_DST + PROBE_SRC + struct.pack('!H', ETH_TYPE_PROBE)
+        frame += struct.pack(PROBE_FORMAT, datapath.id, port, self.clock())
+        frame = frame.ljust(60, b'\0')  # Shortest Ethernet frame
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(port)],
+                                  data=frame)
+        datapath.send_msg(out)
+
+    def probe_in(self, dpid, data):
+        '''
+        A probe came back in from switch dpid (data is the whole frame)
+
+        Returns (dpid, port, latency) for the link it went over, or None if
+        the switches' echo round trips aren't known yet.
+        '''
+        now = self.clock()
+        src, port, sent = struct.unpack_from(PROBE_FORMAT, data, 14)
+        if src not in self.echo_rtt or dpid not in self.echo_rtt:
+            return None
+        one_way = now - sent - self.echo_rtt[src] / 2 - self.echo_rtt[dpid] / 2
+        key = (src, port)
+        self.links[key] = _ewma(self.links.get(key), max(0.0, one_way), self.alpha)
+        return src, port, self.links[key]
+
+    def switch_removed(self, dpid):
+        self.echo_rtt.pop(dpid, None)
+        for key in [k for k in self.links if k[0] == dpid]:
+            del self.links[key]
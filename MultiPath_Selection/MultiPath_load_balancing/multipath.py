@@ -0,0 +1,825 @@
+#!/usr/bin/python3
+
+'''
+Multipath controller with one view of the network for every metric.
+
+Link latency (probes), rate and loss (port stats) and capacity (port
+descriptions) all go into one NetworkState, and a cost model (see
+network_state) turns them into every link's cost at once, kept until the
+state changes.  The switch graph is also kept in arrays (see graph), for
+distances and for costing a pair's paths in one go.  The paths, select
+groups and flow rules are the same whichever model is used.
+
+Paths between switches with hosts are worked out ahead of time in the
+background (see route_precompute) whenever the topology or the costs change, so
+install_paths only has to look them up; pairs the precompute hasn't got
+(yet) go through the path cache.
+
+With FORWARDING = 'proactive', IP traffic isn't set up per connection:
+once a host's switch, port and IP are known, every switch gets one rule
+for that destination, sending it to the neighbours that are closer to the
+host in the precomputed distances (a select group if there's more than
+one).  Always going closer means no loops, and the number of rules and
+PacketIns no longer grows with the number of connections.
+
+Flow and group mods go out through a FlowProgrammer (see flow_programmer):
+queued while an event is handled, then sent per switch in batches with a
+barrier, and the PacketOut only once the barriers are back.
+
+multipathWithLatencyCost and multipathWithBWCost are this controller with
+their own metric.  Run this one with:
+  ryu-manager --observe-links multipath.py
+'''
+
+from import_multipath import *
+import zlib
+import numpy as np
+from path_cache import PathCache
+from flow_programmer import FlowProgrammer, WAIT_TIMEOUT
+from scheduler import Scheduler
+from path_engine import k_shortest_paths
+from graph import Graph
+from route_precompute import RouteJob, RoutePrecompute
+from link_latency import LinkLatency, ETH_TYPE_PROBE
+from network_state import NetworkState, combined_cost
+
+MAX_PATHS = 2
+# How a host pair's traffic is spread over its paths:
+#   'group'    select groups where the paths split; the switches hash flows
+#   'flow'     the controller hashes each flow's 5-tuple onto one path
+#   'flowlet'  like 'flow', but picked again after FLOWLET_TIMEOUT idle
+MULTIPATH_MODE = 'group'
+FLOWLET_TIMEOUT = 1  # Seconds (the smallest idle timeout OpenFlow has)
+GROUP_WEIGHT_SCALE = 100  # Select group bucket weights add up to about this
+# 'reactive': rules per connection along its paths, as PacketIns come in
+# 'proactive': rules per destination host on every switch (ARP stays reactive)
+FORWARDING = 'reactive'
+DESTINATION_PRIORITY = 11111  # Below the per-connection rules
+MIN_DISTANCE_COST = 1e-9  # So distances go down strictly along every link
+STATS_INTERVAL = 1.0  # Seconds between stats requests and probes to each switch
+PRECOMPUTE_INTERVAL = 2.0  # Seconds between checks for whether routes need redoing
+PRECOMPUTE_WORKERS = 0  # Processes for the route precompute; 0 for Ryu's own thread
+# Latency (in 10 ms units) plus utilization, plus loss counted 10 times over
+COST_MODEL = combined_cost(latency=1.0, utilization=1.0, loss=10.0)
+
+@dataclass
+class Paths:
+    ''' Paths container'''
+    path: list()
+    cost: float
+
+class Controller13(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    cost_model = staticmethod(COST_MODEL)
+    # Which way the link metric given to the path cache goes
+    lower_is_better = True
+    # Path search for the route precompute (see route_precompute)
+    route_search = 'shortest'
+
+    def __init__(self, *args, **kwargs):
+        super(Controller13, self).__init__(*args, **kwargs)
+        self.mac_to_port = {}
+        self.neigh = defaultdict(dict) 
+        self.state = NetworkState()
+        self.graph = None  # Built when needed, see topology()
+        self.topology_version = 0
+        self.values = {}  # Cost function -> (array, list) by link id
+        self.values_version = None
+        self.hosts = {} 
+        self.switches = [] 
+        self.arp_table = {} 
+        self.path_table = {} 
+        self.paths_table = {} 
+        self.path_with_ports_table = {} 
+        self.datapath_list = {} 
+        self.multipath_table = {}
+        self.groups = {}  # (dpid, path key) -> (group id, buckets)
+        self.destination_rules = {}  # (dpid, host IP) -> (actions key, out port)
+        self.destinations = {}  # Host IP -> RouteSnapshot its rules follow
+        self.next_group_id = defaultdict(lambda: 1)
+        self.flow_programmer = FlowProgrammer(logger=self.logger)
+        self.scheduler = Scheduler(logger=self.logger)
+        self.path_cache = PathCache(self.find_paths_and_costs, self.may_improve,
+                                    lower_is_better=self.lower_is_better)
+        self.link_latency = LinkLatency()
+        self.routes = None  # Latest RouteSnapshot
+        self.routes_stale = True
+        self.precompute = RoutePrecompute(self.publish_routes, PRECOMPUTE_WORKERS,
+                                          logger=self.logger)
+    
+    def link_id(self, s1, s2):
+        ''' NetworkState id of the link from switch s1 to its neighbour s2 '''
+        return self.state.link_id(s1, self.neigh[s1][s2])
+
+    def topology(self):
+        ''' The switch graph in arrays (see graph), rebuilt when links change '''
+        if self.graph is None:
+            self.graph = Graph.build(self.neigh, self.state.link_id)
+        return self.graph
+
+    def topology_changed(self):
+        self.graph = None
+        self.topology_version += 1
+        self.routes_stale = True
+
+    def link_values(self, fn):
+        '''
+        fn(state, links) for every link, as an array and as a list indexed
+        by link id; worked out once until the state changes
+        '''
+        if self.values_version != self.state.version:
+            self.values = {}
+            self.values_version = self.state.version
+        values = self.values.get(fn)
+        if values is None:
+            array = np.asarray(fn(self.state, slice(0, self.state.size)), dtype=float)
+            values = self.values[fn] = (array, array.tolist())
+        return values
+
+    def link_cost(self, s1, s2):
+        ''' Cost of the link from switch s1 to its neighbour s2 '''
+        link = self.link_id(s1, s2)
+        return self.link_values(self.cost_model)[1][link]
+
+    def link_metric(self, s1, s2):
+        ''' What the path cache watches on each link (see path_cache) '''
+        return self.link_cost(s1, s2)
+
+    def path_costs(self, paths):
+        ''' Costs of a batch of paths (lists of switches), in one go '''
+        graph = self.topology()
+        return graph.path_sums(paths, self.link_values(self.cost_model)[0])
+
+    def find_path_cost(self, path):
+        ''' arg path is a list with all nodes in our route '''
+        return float(self.path_costs([path])[0])
+
+    def refresh_paths(self, paths):
+        ''' Cached paths keep the costs they were found with; bring them up to date '''
+        for p, cost in zip(paths, self.path_costs([p.path for p in paths]).tolist()):
+            p.cost = cost
+
+    def find_paths_and_costs(self, src, dst):
+        '''
+        Yen's k-shortest paths (see path_engine), best MAX_PATHS only
+        Output of this function returns an list on class Paths objects
+        '''
+        if src == dst:
+            return [Paths([src], 0)]
+        graph = self.topology()
+        return self.to_paths(k_shortest_paths(graph, self.route_weights(graph), src, dst, MAX_PATHS))
+
+    def to_paths(self, found):
+        ''' Paths objects for what path_engine (or the precompute) found '''
+        return [Paths(list(path), cost) for cost, path in found]
+
+    def may_improve(self, s1, s2):
+        '''
+        Test for whether a path over link s1 -> s2 could beat the worst of
+        a pair's paths: the cheapest path through it is a lower bound
+        '''
+        graph = self.topology()
+        costs = graph.edge_costs(self.link_values(self.cost_model)[0])
+        to_s1 = graph.distances(s1, graph.reverse_costs(costs))
+        from_s2 = graph.distances(s2, costs)
+        cost = self.link_cost(s1, s2)
+        inf = float('inf')
+
+        def could_beat(src, dst, paths):
+            return len(paths) < MAX_PATHS or \
+                to_s1.get(src, inf) + cost + from_s2.get(dst, inf) < max(p.cost for p in paths)
+        return could_beat
+
+    def update_path_cache(self, dpid):
+        ''' Tell the path cache about this switch's links '''
+        for neighbour in list(self.neigh.get(dpid, ())):
+            if self.path_cache.update_link(dpid, neighbour, self.link_metric(dpid, neighbour)):
+                self.routes_stale = True
+
+    def find_n_optimal_paths(self, paths, number_of_optimal_paths = MAX_PATHS):
+        '''arg paths is an list containing lists of possible paths'''
+        costs = [path.cost for path in paths]
+        optimal_paths_indexes = list(map(costs.index, heapq.nsmallest(number_of_optimal_paths,costs)))
+        optimal_paths = [paths[op_index] for op_index in optimal_paths_indexes]
+        return optimal_paths
+    
+    def path_weights(self, paths):
+        ''' Share of a pair's traffic for each path: inversely to its cost '''
+        return [1.0 / max(p.cost, 1e-6) for p in paths]
+
+    def add_ports_to_paths(self, paths, first_port, last_port):
+        '''
+        Add the ports to all switches including hosts, for each of the paths
+        '''
+        paths_n_ports = list()
+        for p in paths:
+            bar = dict()
+            in_port = first_port
+            for s1, s2 in zip(p.path[:-1], p.path[1:]):
+                out_port = self.neigh[s1][s2]
+                bar[s1] = (in_port, out_port)
+                in_port = self.neigh[s2][s1]
+            bar[p.path[-1]] = (in_port, last_port)
+            paths_n_ports.append(bar)
+        return paths_n_ports
+
+    def merge_paths(self, paths, paths_n_ports, weights):
+        '''
+        Overlay the paths into one loop-free forwarding graph
+
+        Returns {switch: (in ports, {out port: weight})}; a switch with more
+        than one out port is where the paths split.  A path that would make
+        a loop with the (better) ones before it is left out.
+        '''
+        merged = dict()
+        next_hops = defaultdict(set)
+        for p, ports, weight in zip(paths, paths_n_ports, weights):
+            edges = list(zip(p.path[:-1], p.path[1:]))
+            trial = defaultdict(set, {s: set(n) for s, n in next_hops.items()})
+            for s1, s2 in edges:
+                trial[s1].add(s2)
+            if self._has_loop(trial):
+                self.logger.debug(f"Not using path {p.path}: it makes a loop")
+                continue
+            next_hops = trial
+            for node in p.path:
+                in_port, out_port = ports[node]
+                in_ports, out_ports = merged.setdefault(node, (set(), dict()))
+                in_ports.add(in_port)
+                out_ports[out_port] = out_ports.get(out_port, 0) + weight
+        return merged
+
+    @staticmethod
+    def _has_loop(next_hops):
+        ''' Kahn's algorithm: anything left over is on a cycle '''
+        indegree = defaultdict(int)
+        for s, hops in next_hops.items():
+            for n in hops:
+                indegree[n] += 1
+        ready = [s for s in next_hops if not indegree[s]]
+        seen = 0
+        while ready:
+            s = ready.pop()
+            seen += 1
+            for n in next_hops.get(s, ()):
+                indegree[n] -= 1
+                if not indegree[n]:
+                    ready.append(n)
+        return seen < len(set(next_hops) | set(indegree))
+
+    def install_group(self, datapath, key, out_ports):
+        '''
+        Select group spreading a host pair's traffic over out_ports
+
+        Each (switch, host pair) has its own group, modified when the
+        weights change.  Returns the group id.
+        '''
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        total = float(sum(out_ports.values())) or 1.0
+        buckets = tuple(sorted((port, max(1, int(round(GROUP_WEIGHT_SCALE * w / total))))
+                               for port, w in out_ports.items()))
+        current = self.groups.get((datapath.id, key))
+        if current is not None and current[1] == buckets:
+            return current[0]
+        if current is None:
+            group_id = self.next_group_id[datapath.id]
+            self.next_group_id[datapath.id] += 1
+            command = ofproto.OFPGC_ADD
+        else:
+            group_id = current[0]
+            command = ofproto.OFPGC_MODIFY
+        ofp_buckets = [parser.OFPBucket(weight=weight, watch_port=ofproto.OFPP_ANY,
+                                        watch_group=ofproto.OFPG_ANY,
+                                        actions=[parser.OFPActionOutput(port)])
+                       for port, weight in buckets]
+        self.flow_programmer.group_mod(datapath, parser.OFPGroupMod(datapath, command, ofproto.OFPGT_SELECT,
+                                                                    group_id, ofp_buckets))
+        self.groups[(datapath.id, key)] = (group_id, buckets)
+        self.logger.info(f"Select group {group_id} in switch: {datapath.id} buckets (port, weight): {buckets}")
+        return group_id
+
+    def next_hop_weight(self, s, n, distance):
+        ''' Share of traffic from switch s to a destination going via n '''
+        return 1.0 / max(self.link_cost(s, n) + distance, 1e-6)
+
+    def downhill(self, routes, s, dst):
+        '''
+        {out port: weight} of the neighbours of switch s closer to switch
+        dst than s is (by the snapshot's distances)
+        '''
+        here = routes.distance(s, dst)
+        out_ports = dict()
+        for n, port in self.neigh.get(s, {}).items():
+            there = routes.distance(n, dst)
+            if there < here:
+                out_ports[port] = self.next_hop_weight(s, n, there)
+        return out_ports
+
+    def install_destination(self, ip):
+        '''
+        Proactive rules towards host ip on every switch, from the latest
+        precompute; returns False if they can't be made (yet)
+        '''
+        routes = self.routes
+        if routes is None or routes.version != self.topology_version:
+            return False
+        mac = self.arp_table.get(ip)
+        if mac not in self.hosts:
+            return False
+        if self.destinations.get(ip) is routes:
+            return True
+        dst, host_port = self.hosts[mac]
+        for s in list(self.datapath_list):
+            if s == dst:
+                out_ports = {host_port: 1.0}
+            else:
+                out_ports = self.downhill(routes, s, dst)
+            self.install_destination_rule(s, ip, out_ports)
+        self.destinations[ip] = routes
+        return True
+
+    def install_destination_rule(self, dpid, ip, out_ports):
+        ''' The rule (and group) at one switch for traffic to ip '''
+        dp = self.datapath_list[dpid]
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        match = ofp_parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=ip)
+        current = self.destination_rules.get((dpid, ip))
+        if not out_ports:
+            # Can't get there from here
+            if current is not None:
+                self.flow_programmer.flow_mod(dp, ofp_parser.OFPFlowMod(
+                    datapath=dp, command=ofp.OFPFC_DELETE_STRICT, priority=DESTINATION_PRIORITY,
+                    match=match, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
+                del self.destination_rules[(dpid, ip)]
+            return
+        best_port = max(out_ports, key=out_ports.get)
+        if len(out_ports) > 1:
+            group_id = self.install_group(dp, ('destination', ip), out_ports)
+            actions = [ofp_parser.OFPActionGroup(group_id)]
+            key = ('group', group_id)
+        else:
+            actions = [ofp_parser.OFPActionOutput(best_port)]
+            key = ('port', best_port)
+        self.destination_rules[(dpid, ip)] = (key, best_port)
+        if current is not None and current[0] == key:
+            return
+        self.add_flow(dp, DESTINATION_PRIORITY, match, actions, 0)
+        self.logger.info(f"Destination {ip} in switch: {dpid} out: {key}")
+
+    def flow_key(self, type, ip_src, ip_dst, pkt):
+        ''' The 5-tuple (or as much of it as there is) of a packet '''
+        if type == 'UDP':
+            l4 = pkt.get_protocol(udp.udp)
+            return (ip_src, ip_dst, inet.IPPROTO_UDP, l4.src_port, l4.dst_port)
+        if type == 'TCP':
+            l4 = pkt.get_protocol(tcp.tcp)
+            return (ip_src, ip_dst, inet.IPPROTO_TCP, l4.src_port, l4.dst_port)
+        return (ip_src, ip_dst, type)
+
+    def pick_path(self, paths, flow):
+        '''
+        Index of the path a flow should take, in proportion to path_weights
+
+        In 'flow' mode the 5-tuple is hashed, so a flow always gets the same
+        path (while the paths stay the same).  In 'flowlet' mode it's picked
+        at random each time the flow's rules have idled out, so a flow can
+        move between bursts.
+        '''
+        weights = self.path_weights(paths)
+        if MULTIPATH_MODE == 'flowlet':
+            point = random.random()
+        else:
+            point = zlib.crc32(repr(flow).encode()) / 2.0**32
+        point *= sum(weights)
+        for index, weight in enumerate(weights):
+            point -= weight
+            if point < 0:
+                return index
+        return len(weights) - 1
+
+    def install_paths(self, src, first_port, dst, last_port, ip_src, ip_dst, type, pkt):
+
+        if FORWARDING == 'proactive' and type != 'ARP' and self.install_destination(ip_dst):
+            # Nothing per connection; the packet goes the way the rules would send it
+            rule = self.destination_rules.get((src, ip_dst))
+            return rule[1] if rule else self.datapath_list[src].ofproto.OFPP_FLOOD
+
+        self.topology_discover(src, first_port, dst, last_port)
+        
+        key = (src, first_port, dst, last_port)
+        idle_timeout = 10
+        hops = dict()  # switch -> (in ports, actions, what the log gives as its out port)
+        if MULTIPATH_MODE == 'group':
+            for node, (in_ports, out_ports) in self.multipath_table[key].items():
+                ofp_parser = self.datapath_list[node].ofproto_parser
+                if len(out_ports) > 1:
+                    # The paths split here
+                    group_id = self.install_group(self.datapath_list[node], key, out_ports)
+                    hops[node] = (in_ports, [ofp_parser.OFPActionGroup(group_id)], f"group {group_id}")
+                else:
+                    out_port = next(iter(out_ports))
+                    hops[node] = (in_ports, [ofp_parser.OFPActionOutput(out_port)], out_port)
+            # The packet itself goes along the best path
+            first_out_port = self.path_with_ports_table[key][0][src][1]
+        else:
+            # Only this flow, along one of the paths
+            index = self.pick_path(self.path_table[key], self.flow_key(type, ip_src, ip_dst, pkt))
+            for node, (in_port, out_port) in self.path_with_ports_table[key][index].items():
+                ofp_parser = self.datapath_list[node].ofproto_parser
+                hops[node] = ({in_port}, [ofp_parser.OFPActionOutput(out_port)], out_port)
+            first_out_port = self.path_with_ports_table[key][index][src][1]
+            if MULTIPATH_MODE == 'flowlet':
+                idle_timeout = FLOWLET_TIMEOUT
+
+        for node, (in_ports, actions, out_port) in hops.items():
+
+            dp = self.datapath_list[node]
+            ofp = dp.ofproto
+            ofp_parser = dp.ofproto_parser
+
+            for in_port in in_ports:
+                if type == 'UDP':
+                    nw = pkt.get_protocol(ipv4.ipv4)
+                    l4 = pkt.get_protocol(udp.udp)
+                    match = ofp_parser.OFPMatch(in_port = in_port, eth_type=ether_types.ETH_TYPE_IP, ipv4_src=ip_src, ipv4_dst = ip_dst,  
+                                    ip_proto=inet.IPPROTO_UDP, udp_src = l4.src_port, udp_dst = l4.dst_port)
+                    self.logger.info(f"Installed path in switch: {node} out port: {out_port} in port: {in_port} ")
+                    self.add_flow(dp, 33333, match, actions, idle_timeout)
+                    self.logger.info("UDP Flow added ! ")
+                
+                elif type == 'TCP':
+                    nw = pkt.get_protocol(ipv4.ipv4)
+                    l4 = pkt.get_protocol(tcp.tcp)
+                    match = ofp_parser.OFPMatch(in_port = in_port,eth_type=ether_types.ETH_TYPE_IP, ipv4_src=ip_src, ipv4_dst = ip_dst, 
+                                            ip_proto=inet.IPPROTO_TCP,tcp_src = l4.src_port, tcp_dst = l4.dst_port)
+                    self.logger.info(f"Installed path in switch: {node} out port: {out_port} in port: {in_port} ")
+                    self.add_flow(dp, 44444, match, actions, idle_timeout)
+                    self.logger.info("TCP Flow added ! ")
+
+                elif type == 'ICMP':
+                    nw = pkt.get_protocol(ipv4.ipv4)
+                    match = ofp_parser.OFPMatch(in_port=in_port,
+                                            eth_type=ether_types.ETH_TYPE_IP, 
+                                            ipv4_src=ip_src, 
+                                            ipv4_dst = ip_dst, 
+                                            ip_proto=inet.IPPROTO_ICMP)
+                    self.logger.info(f"Installed path in switch: {node} out port: {out_port} in port: {in_port} ")
+                    self.add_flow(dp, 22222, match, actions, idle_timeout)
+                    self.logger.info("ICMP Flow added ! ")
+
+                elif type == 'ARP':
+                    match_arp = ofp_parser.OFPMatch(in_port = in_port,eth_type=ether_types.ETH_TYPE_ARP, arp_spa=ip_src, arp_tpa=ip_dst)
+                    self.logger.info(f"Install path in switch: {node} out port: {out_port} in port: {in_port} ")
+                    self.add_flow(dp, 1, match_arp, actions, idle_timeout)
+                    self.logger.info("ARP Flow added ! ")
+        
+        return first_out_port
+
+    def add_flow(self, datapath, priority, match, actions, idle_timeout, buffer_id = None):
+        ''' Method Provided by the source Ryu library.'''
+        
+        ofproto = datapath.ofproto 
+        parser = datapath.ofproto_parser 
+
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                             actions)]
+        if buffer_id:
+            mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    priority=priority, match=match, idle_timeout = idle_timeout,
+                                    instructions=inst)
+        else:
+            mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
+                                    match=match, idle_timeout = idle_timeout, instructions=inst)
+        # Sent with the rest on the next flush
+        self.flow_programmer.flow_mod(datapath, mod)
+    
+    def run_check(self, ofp_parser, dp):
+        '''
+        Runs every STATS_INTERVAL for each switch (see scheduler): port
+        stats, an echo request for its round trip and a probe out of each
+        of its links (see link_latency)
+        '''
+        dp.send_msg(ofp_parser.OFPPortStatsRequest(dp, 0, dp.ofproto.OFPP_ANY))
+        self.link_latency.send_echo(dp)
+        for port in list(self.neigh.get(dp.id, {}).values()):
+            self.link_latency.send_probe(dp, port)
+
+    def route_weights(self, graph):
+        ''' Each edge's weight for the path search (see path_engine) '''
+        return graph.edge_costs(self.link_values(self.cost_model)[0])
+
+    def distance_costs(self, graph):
+        ''' Each edge's cost for the precompute's distance table '''
+        return np.maximum(graph.edge_costs(self.link_values(self.cost_model)[0]),
+                          MIN_DISTANCE_COST)
+
+    def route_job(self):
+        ''' A precompute of the paths between every two switches with hosts '''
+        graph = self.topology()
+        edge_switches = sorted({dpid for dpid, port in self.hosts.values()
+                                if dpid in graph.index})
+        pairs = [(s, t) for s in edge_switches for t in edge_switches if s != t]
+        return RouteJob(self.topology_version, graph, self.distance_costs(graph),
+                        self.route_weights(graph), pairs, self.route_search, MAX_PATHS)
+
+    def refresh_routes(self):
+        ''' Runs every PRECOMPUTE_INTERVAL: start a precompute if things changed '''
+        if self.routes_stale and self.switches and not self.precompute.running:
+            self.routes_stale = False
+            self.precompute.start(self.route_job())
+
+    def publish_routes(self, snapshot):
+        self.routes = snapshot
+        self.logger.info(f"Routes precomputed for {len(snapshot)} switch pairs")
+        if FORWARDING == 'proactive':
+            for ip in list(self.arp_table):
+                self.install_destination(ip)
+            self.flow_programmer.flush()
+
+    def precomputed_paths(self, src, dst):
+        ''' The pair's paths from the latest precompute, if it's up to date '''
+        routes = self.routes
+        if routes is None or routes.version != self.topology_version:
+            return None
+        found = routes.get(src, dst)
+        return None if found is None else self.to_paths(found)
+
+    def topology_discover(self, src, first_port, dst, last_port):
+        '''
+        Paths between two switches come from the precompute (see route_precompute),
+        or else the cache (see path_cache)
+        '''
+        paths = self.precomputed_paths(src, dst)
+        if paths is None:
+            paths = self.path_cache.get(src, dst)
+        self.refresh_paths(paths)
+        path = self.find_n_optimal_paths(paths)
+        path_with_port = self.add_ports_to_paths(path, first_port, last_port)
+        
+        self.logger.debug(f"Possible paths: {paths}")
+        self.logger.debug(f"Optimal Path with port: {path_with_port}")
+        
+        self.paths_table[(src, first_port, dst, last_port)]  = paths
+        self.path_table[(src, first_port, dst, last_port)] = path
+        self.path_with_ports_table[(src, first_port, dst, last_port)] = path_with_port
+        self.multipath_table[(src, first_port, dst, last_port)] = \
+            self.merge_paths(path, path_with_port, self.path_weights(path))
+
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        if ev.msg.msg_len < ev.msg.total_len:
+            self.logger.debug("packet truncated: only %s of %s bytes", ev.msg.msg_len, ev.msg.total_len)
+        msg = ev.msg
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        in_port = msg.match['in_port']
+
+        pkt = packet.Packet(msg.data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        arp_pkt = pkt.get_protocol(arp.arp)
+        ip_pkt = pkt.get_protocol(ipv4.ipv4)
+        
+        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        if eth.ethertype == ETH_TYPE_PROBE:
+            self.probe_in(datapath.id, msg.data)
+            return
+
+        dst = eth.dst
+        src = eth.src
+        dpid = datapath.id
+        
+        if src not in self.hosts:
+            self.hosts[src] = (dpid, in_port)
+            self.routes_stale = True
+
+        out_port = ofproto.OFPP_FLOOD
+
+        if eth.ethertype == ether_types.ETH_TYPE_IP:
+            nw = pkt.get_protocol(ipv4.ipv4)
+            if nw.proto == inet.IPPROTO_UDP:
+                l4 = pkt.get_protocol(udp.udp)
+            elif nw.proto == inet.IPPROTO_TCP:
+                l4 = pkt.get_protocol(tcp.tcp)     
+
+        if eth.ethertype == ether_types.ETH_TYPE_IP and nw.proto == inet.IPPROTO_UDP:
+            src_ip = nw.src
+            dst_ip = nw.dst
+            
+            self.arp_table[src_ip] = src
+            h1 = self.hosts[src]
+            h2 = self.hosts[dst]
+
+            self.logger.info(f" IP Proto UDP from: {nw.src} to: {nw.dst}")
+
+            out_port = self.install_paths(h1[0], h1[1], h2[0], h2[1], src_ip, dst_ip, 'UDP', pkt)
+            self.install_paths(h2[0], h2[1], h1[0], h1[1], dst_ip, src_ip, 'UDP', pkt) 
+        
+        elif eth.ethertype == ether_types.ETH_TYPE_IP and nw.proto == inet.IPPROTO_TCP:
+            src_ip = nw.src
+            dst_ip = nw.dst
+            
+            self.arp_table[src_ip] = src
+            h1 = self.hosts[src]
+            h2 = self.hosts[dst]
+
+            self.logger.info(f" IP Proto TCP from: {nw.src} to: {nw.dst}")
+
+            out_port = self.install_paths(h1[0], h1[1], h2[0], h2[1], src_ip, dst_ip, 'TCP', pkt)
+            self.install_paths(h2[0], h2[1], h1[0], h1[1], dst_ip, src_ip, 'TCP', pkt) 
+
+        elif eth.ethertype == ether_types.ETH_TYPE_IP and nw.proto == inet.IPPROTO_ICMP:
+            src_ip = nw.src
+            dst_ip = nw.dst
+            
+            self.arp_table[src_ip] = src
+            h1 = self.hosts[src]
+            h2 = self.hosts[dst]
+
+            self.logger.info(f" IP Proto ICMP from: {nw.src} to: {nw.dst}")
+
+            out_port = self.install_paths(h1[0], h1[1], h2[0], h2[1], src_ip, dst_ip, 'ICMP', pkt)
+            self.install_paths(h2[0], h2[1], h1[0], h1[1], dst_ip, src_ip, 'ICMP', pkt)
+
+        elif eth.ethertype == ether_types.ETH_TYPE_ARP:
+            src_ip = arp_pkt.src_ip
+            dst_ip = arp_pkt.dst_ip
+
+            if arp_pkt.opcode == arp.ARP_REPLY:
+                self.arp_table[src_ip] = src
+                h1 = self.hosts[src]
+                h2 = self.hosts[dst]
+
+                self.logger.info(f" ARP Reply from: {src_ip} to: {dst_ip} H1: {h1} H2: {h2}")
+
+                out_port = self.install_paths(h1[0], h1[1], h2[0], h2[1], src_ip, dst_ip, 'ARP', pkt)
+                self.install_paths(h2[0], h2[1], h1[0], h1[1], dst_ip, src_ip, 'ARP', pkt) 
+
+            elif arp_pkt.opcode == arp.ARP_REQUEST:
+                if dst_ip in self.arp_table:
+                    self.arp_table[src_ip] = src
+                    dst_mac = self.arp_table[dst_ip]
+                    h1 = self.hosts[src]
+                    h2 = self.hosts[dst_mac]
+
+                    self.logger.info(f" ARP Reply from: {src_ip} to: {dst_ip} H1: {h1} H2: {h2}")
+
+                    out_port = self.install_paths(h1[0], h1[1], h2[0], h2[1], src_ip, dst_ip, 'ARP', pkt)
+                    self.install_paths(h2[0], h2[1], h1[0], h1[1], dst_ip, src_ip, 'ARP', pkt)
+
+        actions = [parser.OFPActionOutput(out_port)]
+        
+        data = None
+
+        if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+            data = msg.data
+
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id, 
+                                    in_port=in_port, actions=actions, data=data)
+        # Only once the switches have the rules just made for it
+        self.flow_programmer.packet_out(datapath, out)
+        self.flow_programmer.flush()
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def _switch_features_handler(self, ev):
+        ''' 
+        To send packets for which we dont have right information to the controller
+        Method Provided by the source Ryu library. 
+        '''
+
+        datapath = ev.msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        
+        match = parser.OFPMatch()
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        self.add_flow(datapath, 0, match, actions, 10)
+        self.link_latency.catch_probes(datapath, self.add_flow)
+        self.flow_programmer.flush()
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        ''' A batch of flow mods is in (see flow_programmer) '''
+        dpid = ev.msg.datapath.id
+        installed = self.flow_programmer.barrier_reply(dpid, ev.msg.xid)
+        if installed is not None:
+            mods, latency = installed
+            self.logger.info(f"Switch {dpid} installed {mods} rules in {latency * 1000:.1f} ms "
+                             f"(average {self.flow_programmer.latency[dpid] * 1000:.1f} ms)")
+
+    def probe_in(self, dpid, data):
+        ''' A latency probe came back: update the latency of the link it crossed '''
+        measured = self.link_latency.probe_in(dpid, data)
+        if measured is None:
+            return
+        src, port, latency = measured
+        self.state.set_latency(src, port, latency)
+        if self.neigh.get(src, {}).get(dpid) == port:
+            if self.path_cache.update_link(src, dpid, self.link_metric(src, dpid)):
+                self.routes_stale = True
+
+    @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
+    def _echo_reply_handler(self, ev):
+        self.link_latency.echo_reply(ev.msg.datapath.id, ev.msg.data)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        '''Reply to the OFPPortStatsRequest sent by run_check'''
+        switch_dpid = ev.msg.datapath.id
+        now = time.time()
+        body = ev.msg.body
+        # All of the switch's ports in one update
+        self.state.port_stats(switch_dpid, [p.port_no for p in body],
+                              [p.tx_bytes for p in body], [p.tx_packets for p in body],
+                              [p.tx_dropped for p in body], now)
+        self.update_path_cache(switch_dpid)
+
+    def _set_capacity(self, dpid, port):
+        ''' curr_speed is in kbps; 0 means the switch doesn't know '''
+        self.state.set_capacity(dpid, port.port_no, port.curr_speed / 1000.0)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_stats_reply_handler(self, ev):
+        for p in ev.msg.body:
+            self._set_capacity(ev.msg.datapath.id, p)
+        self.update_path_cache(ev.msg.datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def _port_status_handler(self, ev):
+        ''' Port speeds can change (or ports can be added) '''
+        self._set_capacity(ev.msg.datapath.id, ev.msg.desc)
+        self.update_path_cache(ev.msg.datapath.id)
+
+    @set_ev_cls(event.EventSwitchEnter)
+    def switch_enter_handler(self, ev):
+        switch_dp = ev.switch.dp
+        switch_dpid = switch_dp.id
+        ofp_parser = switch_dp.ofproto_parser
+        
+        self.logger.info(f"Switch has been plugged in PID: {switch_dpid}")
+            
+        if switch_dpid not in self.switches:
+            self.datapath_list[switch_dpid] = switch_dp
+            self.switches.append(switch_dpid)
+
+            self.scheduler.every(STATS_INTERVAL, self.run_check, ofp_parser, switch_dp,
+                                 key=switch_dpid) 
+            if 'routes' not in self.scheduler.jobs:
+                # Controller-wide jobs, once (adding them again would restart their timers)
+                self.scheduler.every(PRECOMPUTE_INTERVAL, self.refresh_routes, key='routes')
+                # Packets held for barriers a switch never answers
+                self.scheduler.every(WAIT_TIMEOUT, self.flow_programmer.expire,
+                                     key='flow_programmer')
+            # Link speeds, for utilization and bandwidth left
+            switch_dp.send_msg(ofp_parser.OFPPortDescStatsRequest(switch_dp, 0))
+
+    @set_ev_cls(event.EventSwitchLeave, MAIN_DISPATCHER)
+    def switch_leave_handler(self, ev):
+        switch = ev.switch.dp.id
+        # Whatever else it got to, don't leave packets waiting on its barriers
+        self.flow_programmer.switch_removed(switch)
+        if switch in self.switches:
+            try:
+                self.switches.remove(switch)
+                self.scheduler.cancel(switch)
+                # Its groups are gone if it comes back
+                self.groups = {k: g for k, g in self.groups.items() if k[0] != switch}
+                self.next_group_id.pop(switch, None)
+                self.destination_rules = {k: r for k, r in self.destination_rules.items()
+                                          if k[0] != switch}
+                del self.datapath_list[switch]
+                del self.neigh[switch]
+                for links in self.neigh.values():
+                    links.pop(switch, None)
+                self.path_cache.switch_removed(switch)
+                self.link_latency.switch_removed(switch)
+                self.state.switch_removed(switch)
+                self.topology_changed()
+            except KeyError:
+                self.logger.info(f"Switch has been already pulged off PID{switch}!")
+            
+
+    @set_ev_cls(event.EventLinkAdd, MAIN_DISPATCHER)
+    def link_add_handler(self, ev):
+        self.neigh[ev.link.src.dpid][ev.link.dst.dpid] = ev.link.src.port_no
+        self.neigh[ev.link.dst.dpid][ev.link.src.dpid] = ev.link.dst.port_no
+        self.topology_changed()
+        self.path_cache.link_added(ev.link.src.dpid, ev.link.dst.dpid)
+        self.logger.info(f"Link between switches has been established, SW1 DPID: {ev.link.src.dpid}:{ev.link.dst.port_no} SW2 DPID: {ev.link.dst.dpid}:{ev.link.dst.port_no}")
+
+    @set_ev_cls(event.EventLinkDelete, MAIN_DISPATCHER)
+    def link_delete_handler(self, ev):
+        try:
+            del self.neigh[ev.link.src.dpid][ev.link.dst.dpid] 
+            del self.neigh[ev.link.dst.dpid][ev.link.src.dpid] 
+            self.topology_changed()
+            self.path_cache.link_removed(ev.link.src.dpid, ev.link.dst.dpid)
+        except KeyError:
+            self.logger.info("Link has been already pluged off!")
+            pass
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+'''
+What the controller knows about each link, in one place.
+
+Every switch port the controller hears about (from the topology, port
+stats or latency probes) gets a dense link id, and each metric is a NumPy
+array indexed by it:
+
+  latency      one-way latency in seconds (probes, see link_latency)
+  rate         Mbps sent, from the port's tx_bytes counter
+  loss         fraction of packets dropped on the way out
+  capacity     port speed in Mbps (port descriptions)
+  packet_size  mean packet size in bytes (for the M/M/1 model)
+
+Link ids belong to the (dpid, port) the traffic leaves from, since links
+are measured in the direction they're used.  Ids of a switch that leaves
+are reused.  version goes up on every change, so costs worked out from
+the state can be kept until it moves.
+
+A cost model is a function cost(state, links) -> cost(s), where links is a
+link id or an array (or slice) of them; the controller works out every
+link's cost in one go and uses it as the links' weights in the path
+search.  Models here: latency_cost, utilization_cost, combined_cost(...)
+(a weighted sum of normalized latency, utilization and loss) and mm1_cost
+(latency plus the M/M/1 queueing delay at the link's load).
+'''
+
+import numpy as np
+
+DEFAULT_LATENCY = 0.010  # Seconds, for links not measured yet
+DEFAULT_CAPACITY = 1000.0  # Mbps, for ports whose speed we don't know yet
+DEFAULT_PACKET_SIZE = 1000.0  # Bytes
+REFERENCE_LATENCY = 0.010  # Seconds; latency counted the same as a full link
+MAX_UTILIZATION = 0.99  # Queues are taken as this full at most
+
+NOT_YET = -1.0  # No counters to take a rate from yet
+INITIAL_SIZE = 64
+
+# Array name -> value of a new link (None: from the constructor's defaults)
+FIELDS = {
+    'latency': None,
+    'rate': 0.0,
+    'loss': 0.0,
+    'capacity': None,
+    'packet_size': DEFAULT_PACKET_SIZE,
+    # Port counters at the last stats reply
+    'last_time': NOT_YET,
+    'tx_bytes': 0.0,
+    'tx_packets': 0.0,
+    'tx_dropped': 0.0,
+}
+
+
+class NetworkState:
+    def __init__(self, default_latency=DEFAULT_LATENCY,
+                 default_capacity=DEFAULT_CAPACITY):
+        self.defaults = dict(FIELDS, latency=default_latency,
+                             capacity=default_capacity)
+        self.ids = {}  # (dpid, port) -> link id
+        self.ports = []  # link id -> (dpid, port), or None if free
+        self.free = []
+        self.version = 0
+        for name, default in self.defaults.items():
+            setattr(self, name, np.full(INITIAL_SIZE, default))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def size(self):
+        ''' Number of link ids given out (including free ones) '''
+        return len(self.ports)
+
+    def changed(self):
+        self.version += 1
+
+    def _grow(self):
+        for name, default in self.defaults.items():
+            old = getattr(self, name)
+            new = np.full(2 * len(old), default)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def link_id(self, dpid, port):
+        ''' Id of the link out of this port, given one if it's new '''
+        key = (dpid, port)
+        link = self.ids.get(key)
+        if link is not None:
+            return link
+        if self.free:
+            link = self.free.pop()
+            for name, default in self.defaults.items():
+                getattr(self, name)[link] = default
+            self.ports[link] = key
+        else:
+            link = len(self.ports)
+            if link == len(self.latency):
+                self._grow()
+            self.ports.append(key)
+        self.ids[key] = link
+        self.changed()
+        return link
+
+    def switch_removed(self, dpid):
+        for key in [k for k in self.ids if k[0] == dpid]:
+            link = self.ids.pop(key)
+            self.ports[link] = None
+            self.free.append(link)
+        self.changed()
+
+    def set_latency(self, dpid, port, latency):
+        self.latency[self.link_id(dpid, port)] = latency
+        self.changed()
+
+    def set_capacity(self, dpid, port, capacity):
+        ''' Port speed in Mbps; 0 or None if the switch doesn't know '''
+        self.capacity[self.link_id(dpid, port)] = capacity or self.defaults['capacity']
+        self.changed()
+
+    def port_stats(self, dpid, ports, tx_bytes, tx_packets, tx_dropped, now):
+        '''
+        A switch's port stats reply (one list entry per port): the rate,
+        loss and packet size on each port since the last one
+
+        The first reply for a port only gives counters to start from.
+        '''
+        links = np.array([self.link_id(dpid, p) for p in ports], dtype=np.intp)
+        tx_bytes = np.asarray(tx_bytes, dtype=float)
+        tx_packets = np.asarray(tx_packets, dtype=float)
+        tx_dropped = np.asarray(tx_dropped, dtype=float)
+
+        last = self.last_time[links]
+        seen = last != NOT_YET
+        elapsed = np.maximum(now - last, 0.001)
+        # Counters go backwards if the port was reset
+        sent = np.maximum(tx_bytes - self.tx_bytes[links], 0)
+        packets = np.maximum(tx_packets - self.tx_packets[links], 0)
+        dropped = np.maximum(tx_dropped - self.tx_dropped[links], 0)
+        total = packets + dropped
+
+        self.rate[links] = np.where(seen, sent * 8.0 / 1000000 / elapsed,
+                                    self.rate[links])
+        self.loss[links] = np.where(seen & (total > 0),
+                                    dropped / np.maximum(total, 1),
+                                    self.loss[links])
+        self.packet_size[links] = np.where(seen & (packets > 0),
+                                           sent / np.maximum(packets, 1),
+                                           self.packet_size[links])
+        self.last_time[links] = now
+        self.tx_bytes[links] = tx_bytes
+        self.tx_packets[links] = tx_packets
+        self.tx_dropped[links] = tx_dropped
+        self.changed()
+
+    def utilization(self, links):
+        return self.rate[links] / self.capacity[links]
+
+    def residual(self, links):
+        ''' Mbps left on the links '''
+        return np.maximum(self.capacity[links] - self.rate[links], 0.0)
+
+
+def latency_cost(state, links):
+    return state.latency[links]
+
+
+def utilization_cost(state, links):
+    return np.minimum(state.utilization(links), 1.0)
+
+
+def combined_cost(latency=1.0, utilization=1.0, loss=0.0):
+    '''
+    Weighted sum of the link's latency (in REFERENCE_LATENCYs), its
+    utilization and its loss
+    '''
+    def cost(state, links):
+        return (latency * state.latency[links] / REFERENCE_LATENCY
+                + utilization * np.minimum(state.utilization(links), 1.0)
+                + loss * state.loss[links])
+    return cost
+
+
+def mm1_cost(state, links):
+    '''
+    Expected delay over the link: its latency plus the time a packet
+    spends in an M/M/1 queue at the link's load
+    '''
+    service_rate = state.capacity[links] * 1000000 / (8 * state.packet_size[links])
+    utilization = np.minimum(state.utilization(links), MAX_UTILIZATION)
+    return state.latency[links] + 1.0 / (service_rate * (1.0 - utilization))
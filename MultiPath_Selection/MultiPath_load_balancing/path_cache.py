@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+'''
+Cache of computed paths between pairs of switches.
+
+Paths are computed the first time a (src switch, dst switch) pair is asked
+for and kept until something happens that could change them:
+
+  - a link on one of the pair's paths goes away or gets worse
+  - a link gets better (or is added) and a path over it could beat the
+    worst path the pair has.  The controller works that out:
+    may_improve(u, v) gives a test could_beat(src, dst, paths), usually a
+    lower bound on paths over (u, v) from distances to u and from v.
+
+Changes to a link's metric smaller than the hysteresis threshold (relative
+to the value the cache last acted on) are ignored, so stats noise doesn't
+throw paths away every second.  Invalidated pairs are recomputed the next
+time they're asked for, so the work done follows how much the network
+changes rather than the number of pairs.
+
+Links are directed (u, v) switch pairs, as a path crosses them.
+'''
+
+from collections import defaultdict
+
+HYSTERESIS = 0.2
+
+
+class PathCache:
+    def __init__(self, compute, may_improve, threshold=HYSTERESIS,
+                 lower_is_better=True):
+        '''
+        compute(src, dst) gives a pair's paths (objects with a .path list of
+        switches), best first.  lower_is_better says which way the link
+        metrics given to update_link() go.
+        '''
+        self.compute = compute
+        self.may_improve = may_improve
+        self.threshold = threshold
+        self.lower_is_better = lower_is_better
+        self.entries = {}  # (src, dst) -> paths
+        self.by_link = defaultdict(set)  # (u, v) -> pairs with a path over it
+        self.link_values = {}  # (u, v) -> metric value last acted on
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, src, dst):
+        key = (src, dst)
+        paths = self.entries.get(key)
+        if paths is not None:
+            self.hits += 1
+            return paths
+        self.misses += 1
+        paths = self.compute(src, dst)
+        self.entries[key] = paths
+        for p in paths:
+            for link in zip(p.path[:-1], p.path[1:]):
+                self.by_link[link].add(key)
+        return paths
+
+    def invalidate(self, key):
+        paths = self.entries.pop(key, None)
+        if paths is None:
+            return
+        for p in paths:
+            for link in zip(p.path[:-1], p.path[1:]):
+                users = self.by_link.get(link)
+                if users is not None:
+                    users.discard(key)
+                    if not users:
+                        del self.by_link[link]
+
+    def clear(self):
+        self.entries.clear()
+        self.by_link.clear()
+
+    def _invalidate_users(self, u, v):
+        for key in list(self.by_link.get((u, v), ())):
+            self.invalidate(key)
+
+    def _improved(self, u, v):
+        ''' Link (u, v) got better: its users and anyone it could help '''
+        self._invalidate_users(u, v)
+        if not self.entries:
+            return
+        could_beat = self.may_improve(u, v)
+        for key, paths in list(self.entries.items()):
+            if could_beat(key[0], key[1], paths):
+                self.invalidate(key)
+
+    def link_added(self, u, v):
+        self._improved(u, v)
+        self._improved(v, u)
+
+    def link_removed(self, u, v):
+        self._invalidate_users(u, v)
+        self._invalidate_users(v, u)
+        self.link_values.pop((u, v), None)
+        self.link_values.pop((v, u), None)
+
+    def switch_removed(self, dpid):
+        for key in list(self.entries):
+            if dpid in key:
+                self.invalidate(key)
+        for u, v in list(self.by_link):
+            if dpid in (u, v):
+                self._invalidate_users(u, v)
+
+    def update_link(self, u, v, value):
+        '''
+        A new measurement of link (u, v)'s metric
+
+        Returns True if it was a big enough change to act on.
+        '''
+        old = self.link_values.get((u, v))
+        if old is not None:
+            scale = max(abs(old), abs(value), 1e-9)
+            if abs(value - old) <= self.threshold * scale:
+                return False
+        self.link_values[(u, v)] = value
+        if old is None:
+            # Paths so far were computed with whatever it was before
+            self._improved(u, v)
+        elif (value < old) == self.lower_is_better:
+            self._improved(u, v)
+        else:
+            # Worse: only paths over it can change
+            self._invalidate_users(u, v)
+        return True
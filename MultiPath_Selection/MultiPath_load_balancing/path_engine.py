@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+'''
+Shortest-path search for the multipath controllers.
+
+The searches run over the switch graph in CSR arrays (see graph), on its
+switch indices, and give paths back as lists of dpids.  Link costs are a
+vector with a value for each of the graph's edges (like
+graph.edge_costs() of the controller's costs by link id), so the same
+search works for whatever metric a controller uses.  Costs must not be
+negative.
+
+shortest_path() is Dijkstra with a binary heap.  k_shortest_paths() is
+Yen's algorithm on top of it: it finds the k cheapest loopless paths with
+about k * (path length) Dijkstra runs, instead of listing every path.
+Edges are banned from the spur searches by edge number, so nothing is
+looked up by dpid until the paths are handed back.
+
+widest_path() and k_widest_paths() are the same searches for available
+bandwidth (widest-shortest paths): the vector is what's left on each link,
+and of the paths with the fewest hops, the best is the one with the most
+left on its narrowest link.  Preferring width over hops outright
+(shortest-widest) can't be done with Dijkstra, since the widest way to an
+intermediate switch isn't always part of the best path through it.
+'''
+
+import heapq
+
+import numpy as np
+
+INF = float('inf')
+
+
+def _arrays(graph, edge_values):
+    ''' What the searches walk: indptr, indices and the values, as lists '''
+    indptr, indices = graph.lists()
+    return indptr, indices, np.asarray(edge_values, dtype=float).tolist()
+
+
+def _search(arrays, extend, start, src, dst, banned_nodes=(), banned_edges=()):
+    '''
+    Dijkstra over path labels: (label, nodes, edges) of the best path from
+    switch index src to dst, or None
+
+    A path's label is start extended by each of its edges' values in turn
+    with extend(label, value); smaller labels are better.  Extending a
+    label must never make it smaller, and must keep the order of two
+    labels, which holds for sums of non-negative costs and for
+    (hops, -bottleneck).
+    '''
+    if src == dst:
+        return start, [src], []
+    indptr, indices, values = arrays
+    best = {src: start}
+    prev = {}  # Node -> (node, edge) it was reached by
+    done = set()
+    heap = [(start, src)]
+    while heap:
+        label, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        if u == dst:
+            nodes = [u]
+            edges = []
+            while u != src:
+                u, e = prev[u]
+                nodes.append(u)
+                edges.append(e)
+            nodes.reverse()
+            edges.reverse()
+            return label, nodes, edges
+        done.add(u)
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            if v in done or v in banned_nodes or e in banned_edges:
+                continue
+            new = extend(label, values[e])
+            if v not in best or new < best[v]:
+                best[v] = new
+                prev[v] = (u, e)
+                heapq.heappush(heap, (new, v))
+    return None
+
+
+def _yen(arrays, extend, start, src, dst, k):
+    '''
+    Up to k (label, nodes, edges) for the best loopless paths, best first
+    '''
+    values = arrays[2]
+    first = _search(arrays, extend, start, src, dst)
+    if first is None:
+        return []
+    found = [first]
+    candidates = []  # Heap of (label, nodes, edges)
+    seen = {tuple(first[1])}
+
+    while len(found) < k:
+        _, last, last_edges = found[-1]
+        root_label = start
+        # Branch off the last path found at each of its nodes
+        for i in range(len(last) - 1):
+            spur = last[i]
+            root = last[:i + 1]
+            if i:
+                root_label = extend(root_label, values[last_edges[i - 1]])
+            # Don't repeat a path we already have with the same root...
+            banned_edges = {edges[i] for _, nodes, edges in found
+                            if len(nodes) > i + 1 and nodes[:i + 1] == root}
+            # ...and don't loop back through the root
+            banned_nodes = set(root[:-1])
+            # Starting from the root's label gives the whole path's label
+            spur_path = _search(arrays, extend, root_label, spur, dst,
+                                banned_nodes, banned_edges)
+            if spur_path is None:
+                continue
+            nodes = root[:-1] + spur_path[1]
+            key = tuple(nodes)
+            if key in seen:
+                continue
+            seen.add(key)
+            heapq.heappush(candidates, (spur_path[0], nodes, last_edges[:i] + spur_path[2]))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates))
+
+    return found
+
+
+def _ends(graph, src, dst):
+    index = graph.index
+    if src not in index or dst not in index:
+        return None
+    return index[src], index[dst]
+
+
+def _add(label, value):
+    return label + value
+
+
+def shortest_path(graph, edge_costs, src, dst):
+    '''
+    (cost, path) of the cheapest path from switch src to dst, or None
+    '''
+    return next(iter(k_shortest_paths(graph, edge_costs, src, dst, 1)), None)
+
+
+def k_shortest_paths(graph, edge_costs, src, dst, k):
+    '''
+    List of up to k (cost, path) for the cheapest loopless paths, cheapest first
+    '''
+    ends = _ends(graph, src, dst)
+    if ends is None:
+        return []
+    dpids = graph.dpids
+    return [(cost, [dpids[i] for i in nodes]) for cost, nodes, _ in
+            _yen(_arrays(graph, edge_costs), _add, 0.0, ends[0], ends[1], k)]
+
+
+def _widen(label, capacity):
+    return label[0] + 1, max(label[1], -capacity)
+
+
+def widest_path(graph, edge_capacity, src, dst):
+    '''
+    (bandwidth, path) of the widest-shortest path from switch src to dst,
+    or None
+
+    Of the paths with the fewest hops, the one whose narrowest link (by
+    edge_capacity) has the most bandwidth.
+    '''
+    return next(iter(k_widest_paths(graph, edge_capacity, src, dst, 1)), None)
+
+
+def k_widest_paths(graph, edge_capacity, src, dst, k):
+    '''
+    List of up to k (bandwidth, path) for the widest-shortest loopless paths
+
+    They come fewest hops first, then widest first.
+    '''
+    ends = _ends(graph, src, dst)
+    if ends is None:
+        return []
+    dpids = graph.dpids
+    return [(-label[1], [dpids[i] for i in nodes]) for label, nodes, _ in
+            _yen(_arrays(graph, edge_capacity), _widen, (0, -INF), ends[0], ends[1], k)]
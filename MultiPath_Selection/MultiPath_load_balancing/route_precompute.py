@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+'''
+Routes for every pair of switches, worked out ahead of the traffic.
+
+Instead of the first packet between two hosts waiting for a path search,
+the controller works out in the background:
+
+  - the distance between every two switches (Floyd-Warshall on NumPy
+    arrays for small graphs, a Dijkstra from each switch for bigger ones)
+  - the k best paths between every two switches with hosts on them
+
+and publishes them as a RouteSnapshot, which never changes once made; a
+new one replaces it when the topology or the costs have moved.  Looking a
+pair up is then a dict lookup.
+
+The work is split into chunks of pairs.  With workers=0 the chunks run on
+a green thread that yields to Ryu between them; with workers > 0 they go
+to a process pool, which keeps the controller's own thread free but needs
+the job (graph and costs) copied to the workers.
+
+  precompute = RoutePrecompute(publish, workers=0)
+  precompute.start(RouteJob(...))
+'''
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from types import MappingProxyType
+
+import numpy as np
+
+from ryu.lib import hub
+
+from path_engine import k_shortest_paths, k_widest_paths
+
+FLOYD_WARSHALL_MAX = 300  # Switches; above this, a Dijkstra from each
+CHUNK = 256  # Pairs per piece of work
+ROWS = 32  # Rows of the distance table per piece of work (Dijkstra only)
+POLL = 0.05  # Seconds between checks on the process pool
+
+INF = float('inf')
+
+
+class RouteJob:
+    '''
+    Everything a precompute needs, copied out of the controller
+
+    search is 'shortest' (weights are costs) or 'widest' (weights are
+    bandwidth left); weights and distance_costs (for the distance table)
+    have a value for each of the graph's edges.
+    '''
+    def __init__(self, version, graph, distance_costs, weights, pairs,
+                 search='shortest', k=2):
+        self.version = version
+        self.graph = graph
+        self.distance_costs = np.asarray(distance_costs, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.pairs = list(pairs)
+        self.search = search
+        self.k = k
+
+
+class RouteSnapshot:
+    ''' Distances and paths as they were at one moment; read only '''
+
+    def __init__(self, version, graph, dist, paths):
+        self.version = version
+        self.graph = graph
+        dist.setflags(write=False)
+        self.dist = dist  # [index of src, index of dst]
+        # (src, dst) -> tuple of (cost or bandwidth, tuple of switches)
+        self.paths = MappingProxyType(paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, src, dst):
+        return self.paths.get((src, dst))
+
+    def distance(self, src, dst):
+        index = self.graph.index
+        if src not in index or dst not in index:
+            return INF
+        return float(self.dist[index[src], index[dst]])
+
+
+def floyd_warshall(graph, edge_costs):
+    n = len(graph)
+    dist = np.full((n, n), INF)
+    sources = np.repeat(np.arange(n), np.diff(graph.indptr))
+    np.minimum.at(dist, (sources, graph.indices), edge_costs)
+    np.fill_diagonal(dist, 0.0)
+    for k in range(n):
+        np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+    return dist
+
+
+def dijkstra_rows(graph, edge_costs, sources):
+    ''' Rows of the distance table for the switches (indices) in sources '''
+    rows = np.full((len(sources), len(graph)), INF)
+    index = graph.index
+    for row, i in enumerate(sources):
+        for dpid, d in graph.distances(graph.dpids[i], edge_costs).items():
+            rows[row, index[dpid]] = d
+    return rows
+
+
+def all_pairs_distances(graph, edge_costs):
+    if len(graph) <= FLOYD_WARSHALL_MAX:
+        return floyd_warshall(graph, edge_costs)
+    return dijkstra_rows(graph, edge_costs, range(len(graph)))
+
+
+def find_routes(search, graph, weights, pairs, k):
+    ''' {(src, dst): ((cost or bandwidth, path), ...)} for the pairs '''
+    find = k_shortest_paths if search == 'shortest' else k_widest_paths
+    return {(src, dst): tuple((value, tuple(path)) for value, path in
+                              find(graph, weights, src, dst, k))
+            for src, dst in pairs}
+
+
+def compute_routes(job):
+    ''' The whole precompute in one go, on this thread '''
+    dist = all_pairs_distances(job.graph, job.distance_costs)
+    paths = find_routes(job.search, job.graph, job.weights, job.pairs, job.k)
+    return RouteSnapshot(job.version, job.graph, dist, paths)
+
+
+class RoutePrecompute:
+    def __init__(self, publish, workers=0, logger=None):
+        ''' publish(snapshot) is called (on Ryu's thread) when one is done '''
+        self.publish = publish
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.pool = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, job):
+        ''' Start working on job, unless a precompute is already running '''
+        if self.running:
+            return False
+        self.thread = hub.spawn(self._run, job)
+        return True
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _chunks(self, job):
+        for i in range(0, len(job.pairs), CHUNK):
+            yield job.pairs[i:i + CHUNK]
+
+    def _run(self, job):
+        try:
+            if self.workers:
+                snapshot = self._run_pool(job)
+            else:
+                snapshot = self._run_here(job)
+            self.publish(snapshot)
+        except Exception:
+            self.logger.exception("Route precompute failed")
+        finally:
+            self.thread = None
+
+    def _run_here(self, job):
+        graph = job.graph
+        if len(graph) <= FLOYD_WARSHALL_MAX:
+            dist = floyd_warshall(graph, job.distance_costs)
+        else:
+            rows = []
+            for i in range(0, len(graph), ROWS):
+                hub.sleep(0)
+                rows.append(dijkstra_rows(graph, job.distance_costs,
+                                          range(i, min(i + ROWS, len(graph)))))
+            dist = np.vstack(rows)
+        paths = {}
+        for pairs in self._chunks(job):
+            hub.sleep(0)
+            paths.update(find_routes(job.search, job.graph, job.weights, pairs, job.k))
+        return RouteSnapshot(job.version, job.graph, dist, paths)
+
+    def _run_pool(self, job):
+        if self.pool is None:
+            # Not fork: the workers mustn't inherit Ryu's green threads
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'))
+        futures = [self.pool.submit(all_pairs_distances, job.graph, job.distance_costs)]
+        futures += [self.pool.submit(find_routes, job.search, job.graph, job.weights,
+                                     pairs, job.k)
+                    for pairs in self._chunks(job)]
+        while not all(f.done() for f in futures):
+            hub.sleep(POLL)
+        paths = {}
+        for f in futures[1:]:
+            paths.update(f.result())
+        return RouteSnapshot(job.version, job.graph, futures[0].result(), paths)
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+'''
+Periodic jobs for the controllers on a single Ryu green thread.
+
+Instead of every job re-arming its own threading.Timer (a new OS thread
+per run, racing the Ryu event loop on shared state), jobs are kept in a
+timing wheel and run from one hub thread, between Ryu's event handlers.
+Every job due in the same tick runs in the same pass.
+
+Jobs repeat every interval, give or take the jitter (a fraction of the
+interval), so jobs added at the same moment (like polling every switch
+as they all connect) spread out instead of firing together.  A job can be
+given a key (e.g., a dpid) and cancelled by it.
+
+  scheduler.every(1.0, self._send_port_stats_request, dp, key=dp.id)
+  scheduler.cancel(dp.id)
+'''
+
+import logging
+import random
+import time
+
+from ryu.lib import hub
+
+TICK = 0.05  # Seconds
+SLOTS = 256
+JITTER = 0.1
+
+
+class Job:
+    __slots__ = ('interval', 'fn', 'args', 'key', 'jitter', 'due', 'cancelled')
+
+    def __init__(self, interval, fn, args, key, jitter):
+        self.interval = interval
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.jitter = jitter
+        self.due = 0  # Tick
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self, tick=TICK, slots=SLOTS, logger=None):
+        self.tick = tick
+        self.wheel = [[] for _ in range(slots)]
+        self.jobs = {}  # key -> Job
+        self.logger = logger or logging.getLogger(__name__)
+        self.start_time = None
+        self.current = 0  # Last tick run
+        self.thread = None
+
+    def _now(self):
+        return int((time.monotonic() - self.start_time) / self.tick)
+
+    def _file(self, job, delay):
+        job.due = self.current + max(1, int(round(delay / self.tick)))
+        self.wheel[job.due % len(self.wheel)].append(job)
+
+    def every(self, interval, fn, *args, key=None, jitter=JITTER):
+        '''
+        Run fn(*args) every interval seconds until cancelled
+
+        The first run is somewhere in the first interval.  Adding a job with
+        the key of an existing one replaces it.
+        '''
+        if self.thread is None:
+            self.start_time = time.monotonic()
+            self.thread = hub.spawn(self._run)
+        if key is not None:
+            self.cancel(key)
+        job = Job(interval, fn, args, key, jitter)
+        if key is not None:
+            self.jobs[key] = job
+        self._file(job, random.uniform(0, interval))
+        return job
+
+    def cancel(self, key):
+        job = self.jobs.pop(key, None)
+        if job is not None:
+            job.cancel()
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+
+    def _run(self):
+        while True:
+            now = self._now()
+            while self.current < now:
+                self.current += 1
+                self._run_tick()
+            hub.sleep(max(0, self.start_time + (self.current + 1) * self.tick - time.monotonic()))
+
+    def _run_tick(self):
+        slot = self.current % len(self.wheel)
+        due = self.wheel[slot]
+        if not due:
+            return
+        self.wheel[slot] = []
+        for job in due:
+            if job.cancelled:
+                continue
+            if job.due > self.current:
+                # A later lap of the wheel
+                self.wheel[slot].append(job)
+                continue
+            try:
+                job.fn(*job.args)
+            except Exception:
+                self.logger.exception(f"Scheduled job {job.fn.__name__} failed")
+            if not job.cancelled:
+                spread = job.interval * job.jitter
+                self._file(job, job.interval + random.uniform(-spread, spread))
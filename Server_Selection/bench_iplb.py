@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+
+"""
+Benchmark the IP load balancer's PacketIn path without a switch
+
+This drives iplb directly: a fake connection takes (and packs, like the
+real one) the messages it sends, and synthetic PacketIn events carry real
+parsed packets, either generated (a TCP SYN from a new client port each)
+or read from a pcap file.  POX has to be importable, but it isn't booted
+and nothing needs root.
+
+For each strategy it reports:
+  new flows/sec         PacketIns for new connections handled per second
+  PacketIn latency      p50/p99/max time spent in _handle_PacketIn
+  replies/sec           The same for the servers' first answers
+  bytes/flow            Memory held per remembered flow (via tracemalloc)
+
+Run it from this directory with POX on the path, e.g.:
+  PYTHONPATH=~/pox python3 bench_iplb.py --flows 50000
+  PYTHONPATH=~/pox python3 bench_iplb.py --pcap syns.pcap --ip 10.0.1.1
+
+--json saves the results; --baseline compares new flows/sec against saved
+results and exits with an error if any strategy got more than --tolerance
+slower, which is meant for CI.
+"""
+
+import argparse
+import json
+import logging
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+import pox.core
+if pox.core.core is None:
+  pox.core.initialize()
+from pox.core import core
+
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.packet.tcp import tcp
+from pox.lib.addresses import IPAddr, EthAddr
+import pox.openflow.libopenflow_01 as of
+
+import ip_loadbalancer
+from lb_strategies import make_strategy
+from latency_histogram import Histogram
+
+STRATEGIES = ('round_robin', 'weighted', 'least_conn', 'random')
+
+LB_MAC = EthAddr("02:00:00:00:01:01")
+
+
+class FakeConnection (object):
+  """
+  Stands in for a switch connection; counts what gets sent to it
+  """
+  def __init__ (self, dpid = 1, pack = True):
+    self.dpid = dpid
+    self.eth_addr = LB_MAC
+    self.pack = pack
+    self.sent = {} # Message class name -> count
+    self.bytes = 0
+
+  def send (self, msg):
+    if self.pack:
+      # Like Connection.send()
+      self.bytes += len(msg.pack())
+    name = type(msg).__name__
+    self.sent[name] = self.sent.get(name, 0) + 1
+
+
+class FakeEvent (object):
+  """
+  Just enough of a PacketIn event for iplb
+  """
+  def __init__ (self, connection, port, raw):
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.port = port
+    self.parsed = ethernet(raw)
+    self.ofp = of.ofp_packet_in(in_port = port, data = raw,
+                                total_len = len(raw))
+    self.ofp.buffer_id = None # So flow_mods carry the packet with them
+
+
+def make_syn (src, srcport, dst, dstport, src_mac, dst_mac, syn = True,
+              ack = False):
+  t = tcp()
+  t.srcport = srcport
+  t.dstport = dstport
+  t.seq = random.randint(0, 0xffffffff)
+  t.ack = random.randint(0, 0xffffffff) if ack else 0
+  t.off = 5
+  t.win = 29200
+  t.SYN = syn
+  t.ACK = ack
+  i = ipv4(protocol = ipv4.TCP_PROTOCOL, srcip = src, dstip = dst)
+  i.set_payload(t)
+  e = ethernet(type = ethernet.IP_TYPE, src = src_mac, dst = dst_mac)
+  e.set_payload(i)
+  return e.pack()
+
+
+def generate_flows (service_ip, count, clients = 254, client_net = "10.0.0.0"):
+  """
+  Raw frames for count new connections to service_ip
+
+  Clients are spread over client_net (after the servers' addresses).
+  """
+  base = IPAddr(client_net).toUnsigned() + 100
+  frames = []
+  for n in range(count):
+    c = n % clients
+    client = IPAddr(base + c)
+    mac = EthAddr(struct.pack("!HI", 0x0200, client.toUnsigned()))
+    port = 1024 + (n // clients) % 64000
+    frames.append((c % 8 + 10, make_syn(client, port, service_ip, 80, mac,
+                                        LB_MAC)))
+  return frames
+
+
+def read_pcap (path, service_ip):
+  """
+  Raw Ethernet frames of the TCP packets to service_ip in a pcap file
+  """
+  frames = []
+  with open(path, 'rb') as f:
+    header = f.read(24)
+    magic = struct.unpack("<I", header[:4])[0]
+    if magic in (0xa1b2c3d4, 0xa1b23c4d):
+      endian = "<"
+    elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+      endian = ">"
+    else:
+      raise RuntimeError("%s isn't a pcap file" % (path,))
+    if struct.unpack(endian + "I", header[20:24])[0] != 1:
+      raise RuntimeError("%s isn't an Ethernet capture" % (path,))
+    while True:
+      record = f.read(16)
+      if len(record) < 16: break
+      length = struct.unpack(endian + "IIII", record)[2]
+      raw = f.read(length)
+      p = ethernet(raw)
+      ipp = p.find('ipv4')
+      if ipp and p.find('tcp') and ipp.dstip == service_ip:
+        frames.append((10, raw))
+  return frames
+
+
+def make_lb (strategy, service_ip, servers, pack):
+  con = FakeConnection(pack = pack)
+  weights = dict(zip(servers, range(len(servers), 0, -1)))
+  lb = ip_loadbalancer.iplb(con, service_ip, servers,
+                            make_strategy(strategy, weights))
+  # Bring all the servers up without waiting for probes
+  for n,ip in enumerate(lb.servers):
+    h = lb.health.health[ip]
+    h.mac = EthAddr(struct.pack("!HI", 0x0200, n + 1))
+    h.port = n + 1
+    h.up = True
+    lb._server_up(ip, h.mac, h.port)
+  return lb, con
+
+
+def run_events (lb, events, hist = None):
+  handle = lb._handle_PacketIn
+  clock = time.perf_counter
+  start = clock()
+  if hist is None:
+    for e in events:
+      handle(e)
+  else:
+    for e in events:
+      t = clock()
+      handle(e)
+      hist.record(clock() - t)
+  return clock() - start
+
+
+def reply_events (lb, con, events):
+  """
+  A SYN-ACK from the chosen server for each of the flows in events
+  """
+  replies = []
+  for e in events:
+    ipp = e.parsed.find('ipv4')
+    tcpp = e.parsed.find('tcp')
+    entry = lb.memory.get(ip_loadbalancer.flow_key(ipp, tcpp))
+    if entry is None: continue
+    mac,port = lb.live_servers[entry.server]
+    raw = make_syn(entry.server, tcpp.dstport, ipp.srcip, tcpp.srcport,
+                   mac, LB_MAC, ack = True)
+    replies.append(FakeEvent(con, port, raw))
+  return replies
+
+
+def bench (strategy, frames, service_ip, servers, pack = True):
+  result = {'strategy': strategy, 'flows': len(frames)}
+
+  # Timing
+  lb,con = make_lb(strategy, service_ip, servers, pack)
+  events = [FakeEvent(con, port, raw) for port,raw in frames]
+  hist = Histogram()
+  elapsed = run_events(lb, events, hist)
+  result['new_flows_per_sec'] = len(events) / elapsed
+  result.update(hist.summary('packet_in_', (50, 99)))
+  del result['packet_in_count']
+
+  replies = reply_events(lb, con, events)
+  hist = Histogram()
+  elapsed = run_events(lb, replies, hist)
+  result['replies_per_sec'] = len(replies) / elapsed if replies else None
+  result['reply_p99'] = hist.percentile(99)
+  result['remembered'] = len(lb.memory)
+  result['sent'] = dict(con.sent)
+
+  # Memory, in a separate run since tracemalloc slows everything down
+  lb,con = make_lb(strategy, service_ip, servers, pack)
+  events = [FakeEvent(con, port, raw) for port,raw in frames]
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  run_events(lb, events)
+  after = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  result['bytes_per_flow'] = (after - before) / len(lb.memory) if len(lb.memory) else None
+
+  return result
+
+
+def print_result (r):
+  us = lambda v: "%.1f" % (v * 1e6,) if v is not None else "-"
+  print("%-12s %9.0f new flows/s  PacketIn us: p50 %s p99 %s max %s  "
+        "%s replies/s  %s bytes/flow" % (
+        r['strategy'], r['new_flows_per_sec'], us(r['packet_in_p50']),
+        us(r['packet_in_p99']), us(r['packet_in_max']),
+        "%.0f" % r['replies_per_sec'] if r['replies_per_sec'] else "-",
+        "%.0f" % r['bytes_per_flow'] if r['bytes_per_flow'] else "-"))
+
+
+def check_baseline (results, path, tolerance):
+  with open(path) as f:
+    baseline = {r['strategy']:r for r in json.load(f)}
+  ok = True
+  for r in results:
+    b = baseline.get(r['strategy'])
+    if b is None: continue
+    if r['new_flows_per_sec'] < b['new_flows_per_sec'] * (1 - tolerance):
+      print("REGRESSION: %s %.0f new flows/s, baseline %.0f"
+            % (r['strategy'], r['new_flows_per_sec'], b['new_flows_per_sec']))
+      ok = False
+  return ok
+
+
+def main ():
+  parser = argparse.ArgumentParser(description = __doc__,
+      formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--strategies', default = ",".join(STRATEGIES),
+                      help = "Comma-separated strategies to run")
+  parser.add_argument('--flows', type = int, default = 20000,
+                      help = "Number of generated new flows")
+  parser.add_argument('--pcap', help = "Use the TCP packets to --ip in this file")
+  parser.add_argument('--ip', default = "10.0.1.1", help = "Service IP")
+  parser.add_argument('--servers', type = int, default = 5)
+  parser.add_argument('--no-pack', action = 'store_true',
+                      help = "Don't pack the messages sent to the switch")
+  parser.add_argument('--seed', type = int, default = 1)
+  parser.add_argument('--json', help = "Save the results to this file")
+  parser.add_argument('--baseline', help = "Compare with results saved with --json")
+  parser.add_argument('--tolerance', type = float, default = 0.2)
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  logging.getLogger().setLevel(logging.WARNING)
+  # Nothing should be scheduled; probes and stats are driven by hand
+  core.callDelayed = lambda *args, **kw: None
+  core.callLater = lambda *args, **kw: None
+
+  service_ip = IPAddr(args.ip)
+  servers = [IPAddr("10.0.0.%i" % (i + 1,)) for i in range(args.servers)]
+  if args.pcap:
+    frames = read_pcap(args.pcap, service_ip)
+  else:
+    frames = generate_flows(service_ip, args.flows)
+
+  results = []
+  for strategy in args.strategies.split(","):
+    r = bench(strategy, frames, service_ip, servers, not args.no_pack)
+    print_result(r)
+    results.append(r)
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent = 2)
+  if args.baseline and not check_baseline(results, args.baseline,
+                                          args.tolerance):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,96 @@
+"""
+Flow memory for the IP load balancer
+
+The balancer remembers which server each flow went to for a few minutes,
+which can mean hundreds of thousands of entries.  Expiring them by walking
+the whole table every probe tick gets expensive, so entries are also filed
+in a hashed timer wheel: one slot per second of deadline, and each tick
+only looks at the slots that have come due.
+
+Refreshing an entry just moves its deadline; it stays in its old slot
+until that slot comes due, and is then refiled under its new deadline.
+So a tick costs time proportional to the entries that expire or were
+refreshed, not to the size of the table.
+
+Entries need key1, key2 (they're found under both) and timeout (absolute
+time at which they expire) attributes.  This module doesn't depend on POX.
+"""
+
+
+class FlowMemory (object):
+  def __init__ (self, timeout, tick = 1.0):
+    self.tick = float(tick)
+    slots = 1
+    while slots * self.tick <= timeout:
+      slots *= 2
+    self._mask = slots - 1
+    self._wheel = [[] for _ in range(slots)]
+    self._table = {} # key1 or key2 -> entry
+    self._count = 0 # Number of entries (each is in _table twice)
+    self._last_tick = None
+
+  def __len__ (self):
+    return self._count
+
+  def get (self, key, default = None):
+    return self._table.get(key, default)
+
+  def _file (self, entry, not_before = None):
+    t = int(entry.timeout / self.tick)
+    if not_before is not None and t < not_before:
+      t = not_before
+    self._wheel[t & self._mask].append(entry)
+
+  def add (self, entry):
+    """
+    Remember an entry, replacing any entries with the same keys
+    """
+    for k in (entry.key1, entry.key2):
+      old = self._table.get(k)
+      if old is not None:
+        self._remove(old)
+    self._table[entry.key1] = entry
+    self._table[entry.key2] = entry
+    self._count += 1
+    self._file(entry)
+
+  def _remove (self, entry):
+    # Its wheel slot still points at it; that gets noticed when the slot
+    # comes due.
+    if self._table.get(entry.key1) is entry:
+      del self._table[entry.key1]
+    if self._table.get(entry.key2) is entry:
+      del self._table[entry.key2]
+    self._count -= 1
+
+  def expire (self, now):
+    """
+    Forget entries whose timeout is before now
+
+    Returns the list of entries which were forgotten.
+    """
+    expired = []
+    current = int(now / self.tick)
+    if self._last_tick is None:
+      self._last_tick = current - 1
+    # After a long pause, every slot is due, but only once
+    first = max(self._last_tick + 1, current - self._mask)
+    self._last_tick = current
+
+    for t in range(first, current + 1):
+      i = t & self._mask
+      due = self._wheel[i]
+      if not due: continue
+      self._wheel[i] = []
+      for entry in due:
+        if self._table.get(entry.key1) is not entry:
+          # Replaced (or already expired)
+          continue
+        if entry.timeout < now:
+          self._remove(entry)
+          expired.append(entry)
+        else:
+          # Refreshed since it was filed (or due later in this tick)
+          self._file(entry, current + 1)
+
+    return expired
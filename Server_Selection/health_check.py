@@ -0,0 +1,260 @@
+"""
+Server health checking for the IP load balancer
+
+Every probe interval, all servers are probed at once rather than one at a
+time, so how long it takes to notice a dead server doesn't depend on how
+many servers there are.
+
+Each server is always ARPed, since that's how we find out which MAC and
+switch port it's on.  What counts as "healthy" depends on the mode:
+
+  arp   It answers ARP (which is all the balancer used to check)
+  tcp   It answers a TCP SYN to the service port with a SYN-ACK.  The SYN
+        is sent from the service IP through the switch, and we reset the
+        connection once we've seen the answer.
+  http  A GET for the health path gets a non-5xx answer.  This is done
+        with a real socket from the controller, so the controller must be
+        able to reach the servers' addresses.
+
+A server goes up after `rise` healthy probes in a row and down after
+`fall` failed ones.  An unanswered probe counts as failed at the first
+round after `timeout`, so the timeout is kept below the interval (where
+timer jitter can't push it a round later).  Probe round-trip times are kept per server (the last
+one and a moving average) in rtt and last_rtt.
+"""
+
+from pox.core import core
+log = core.getLogger("iplb")
+
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.packet.tcp import tcp
+import pox.openflow.libopenflow_01 as of
+
+import time
+import random
+import threading
+
+MODES = ('arp', 'tcp', 'http')
+
+# Weight of the newest sample in the RTT moving average
+RTT_ALPHA = 0.2
+
+# Source ports for our TCP probes
+PROBE_PORT_MIN = 40000
+PROBE_PORT_MAX = 60000
+
+
+class ServerHealth (object):
+  """
+  What we know about one server
+  """
+  __slots__ = ('ip', 'mac', 'port', 'up', 'successes', 'failures',
+               'arp_sent', 'check_sent', 'rtt', 'last_rtt')
+
+  def __init__ (self, ip):
+    self.ip = ip
+    self.mac = None # Where we last heard from it
+    self.port = None
+    self.up = False
+    self.successes = 0 # In a row
+    self.failures = 0 # In a row
+    self.arp_sent = None # Time of the outstanding ARP
+    self.check_sent = None # Time of the outstanding TCP/HTTP check
+    self.rtt = None
+    self.last_rtt = None
+
+
+class HealthChecker (object):
+  def __init__ (self, lb, servers, mode = 'arp', interval = 1,
+                timeout = 0.5, rise = 2, fall = 3, port = 80, path = '/'):
+    if mode not in MODES:
+      raise RuntimeError("Unknown health check '%s' (try one of: %s)"
+                         % (mode, ", ".join(MODES)))
+    if float(timeout) > float(interval):
+      raise RuntimeError("Probe timeout (%s) can't be longer than the probe "
+                         "interval (%s)" % (timeout, interval))
+    self.lb = lb
+    self.mode = mode
+    self.interval = float(interval)
+    self.timeout = float(timeout)
+    self.rise = int(rise)
+    self.fall = int(fall)
+    self.port = int(port) # Service port for tcp/http checks
+    self.path = path
+    self.health = {ip:ServerHealth(ip) for ip in servers}
+    self._tcp_probes = {} # Our source port -> (server IP, time sent)
+    self._next_port = random.randint(PROBE_PORT_MIN, PROBE_PORT_MAX)
+
+  @property
+  def rtt (self):
+    """
+    Server IP -> smoothed probe RTT in seconds
+    """
+    return {ip:h.rtt for ip,h in self.health.items() if h.rtt is not None}
+
+  @property
+  def last_rtt (self):
+    return {ip:h.last_rtt for ip,h in self.health.items()
+            if h.last_rtt is not None}
+
+  def probe_all (self):
+    """
+    Time out the last round's probes and send a new round
+    """
+    now = time.time()
+    for h in self.health.values():
+      if h.arp_sent is not None and now - h.arp_sent >= self.timeout:
+        h.arp_sent = None
+        if self.mode == 'arp':
+          self._failure(h)
+      if h.check_sent is not None and now - h.check_sent >= self.timeout:
+        h.check_sent = None
+        self._failure(h)
+
+    # Forget TCP probes nobody answered
+    for p,(ip,sent) in list(self._tcp_probes.items()):
+      if now - sent >= self.timeout:
+        del self._tcp_probes[p]
+
+    for h in self.health.values():
+      if h.arp_sent is None:
+        h.arp_sent = now
+        self.lb._send_arp(h.ip)
+      if h.check_sent is not None:
+        continue
+      if self.mode == 'tcp' and h.port is not None:
+        h.check_sent = now
+        self._send_syn(h)
+      elif self.mode == 'http':
+        h.check_sent = now
+        t = threading.Thread(target = self._http_check, args = (h.ip, now))
+        t.daemon = True
+        t.start()
+
+  def _success (self, h, rtt):
+    h.failures = 0
+    h.successes += 1
+    h.last_rtt = rtt
+    if h.rtt is None:
+      h.rtt = rtt
+    else:
+      h.rtt += RTT_ALPHA * (rtt - h.rtt)
+    if self.mode != 'arp':
+      # This says something about how quickly the service answers
+      self.lb.strategy.observe_latency(h.ip, rtt)
+    self._maybe_up(h)
+
+  def _maybe_up (self, h):
+    if not h.up and h.successes >= self.rise and h.port is not None:
+      h.up = True
+      log.info("Server %s up", h.ip)
+      self.lb._server_up(h.ip, h.mac, h.port)
+
+  def _failure (self, h):
+    h.successes = 0
+    h.failures += 1
+    if h.up and h.failures >= self.fall:
+      h.up = False
+      log.warn("Server %s down", h.ip)
+      self.lb._server_down(h.ip)
+
+  def arp_reply (self, ip, mac, port):
+    """
+    A server answered our ARP
+    """
+    h = self.health[ip]
+    moved = (mac,port) != (h.mac,h.port)
+    h.mac,h.port = mac,port
+    if h.up and moved:
+      self.lb._server_up(ip, mac, port)
+
+    if h.arp_sent is None: return
+    rtt = time.time() - h.arp_sent
+    h.arp_sent = None
+    if self.mode == 'arp':
+      self._success(h, rtt)
+    else:
+      # Might have had enough successful checks but nowhere to send to
+      self._maybe_up(h)
+
+  def _send_tcp (self, h, srcport, seq, ack = 0, syn = False, rst = False):
+    t = tcp()
+    t.srcport = srcport
+    t.dstport = self.port
+    t.seq = seq
+    t.ack = ack
+    t.off = 5
+    t.win = 0 if rst else 29200
+    t.SYN = syn
+    t.RST = rst
+    t.ACK = bool(ack)
+    i = ipv4(protocol = ipv4.TCP_PROTOCOL, srcip = self.lb.service_ip,
+             dstip = h.ip)
+    i.set_payload(t)
+    e = ethernet(type = ethernet.IP_TYPE, src = self.lb.mac, dst = h.mac)
+    e.set_payload(i)
+    msg = of.ofp_packet_out()
+    msg.data = e.pack()
+    msg.actions.append(of.ofp_action_output(port = h.port))
+    msg.in_port = of.OFPP_NONE
+    self.lb.con.send(msg)
+
+  def _send_syn (self, h):
+    srcport = self._next_port
+    self._next_port += 1
+    if self._next_port > PROBE_PORT_MAX:
+      self._next_port = PROBE_PORT_MIN
+    self._tcp_probes[srcport] = h.ip, time.time()
+    self._send_tcp(h, srcport, random.randint(0, 0xffffffff), syn = True)
+
+  def tcp_reply (self, ipp, tcpp):
+    """
+    Look at a TCP packet from a server to the service IP
+
+    Returns True if it was the answer to one of our probes.
+    """
+    probe = self._tcp_probes.get(tcpp.dstport)
+    if probe is None or probe[0] != ipp.srcip:
+      return False
+    del self._tcp_probes[tcpp.dstport]
+    ip,sent = probe
+    h = self.health[ip]
+    h.check_sent = None
+    if tcpp.SYN and tcpp.ACK:
+      # Listening; don't leave it hanging
+      self._send_tcp(h, tcpp.dstport, tcpp.ack, rst = True)
+      self._success(h, time.time() - sent)
+    else:
+      # Probably a RST -- nobody home on that port
+      self._failure(h)
+    return True
+
+  def _http_check (self, ip, sent):
+    """
+    Runs in its own thread
+    """
+    import http.client
+    start = time.time()
+    ok = False
+    try:
+      c = http.client.HTTPConnection(str(ip), self.port, timeout=self.timeout)
+      try:
+        c.request("GET", self.path)
+        ok = c.getresponse().status < 500
+      finally:
+        c.close()
+    except Exception:
+      pass
+    core.callLater(self._http_result, ip, sent, ok, time.time() - start)
+
+  def _http_result (self, ip, sent, ok, rtt):
+    h = self.health[ip]
+    if h.check_sent != sent:
+      # Too late; it already counted as a failure
+      return
+    h.check_sent = None
+    if ok:
+      self._success(h, rtt)
+    else:
+      self._failure(h)
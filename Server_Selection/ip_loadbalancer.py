@@ -0,0 +1,657 @@
+# Copyright 2013,2014 James McCauley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A very sloppy IP load balancer.
+
+Run it with --ip=<Service IP> --servers=IP1,IP2,...
+
+The server selection algorithm is picked with --strategy=<name>, one of
+round_robin, weighted, least_conn, least_load, least_bytes, least_latency,
+random (the default), hash or source_hash.  Weighted round-robin (and the hash
+strategies) take weights from --weights=W1,W2,... in the same order as
+--servers.
+
+least_load and least_bytes balance on what the switch actually sees: they
+poll flow stats every --stats_interval seconds (default 2) and pick the
+server with the fewest active flows or the lowest byte rate.
+
+With --proactive=<client prefix> (e.g., 10.0.0.0/24), new connections don't
+come to the controller at all.  The client prefix is split into --buckets
+(default 16) smaller prefixes, each bucket is given to a server (in
+proportion to the weights), and a wildcard rewrite entry is installed for
+each bucket.  When servers come and go, only the buckets that have to move
+are moved.  Return traffic needs one entry per client/server pair, which is
+installed the first time we see it.  The tradeoff is granularity: all
+clients in a bucket go to the same server.
+
+Servers are health checked every --probe_interval seconds (default 1) with
+--health=arp (the default), tcp or http (see health_check for details and
+the other options); --rise and --fall say how many good or bad checks in a
+row bring a server up or down.
+
+By default, it will do load balancing on the first switch that connects.  If
+you want, you can add --dpid=<dpid> to specify a particular switch.
+
+Please submit improvements. :)
+"""
+
+from pox.core import core
+import pox
+log = core.getLogger("iplb")
+
+from pox.lib.packet.ethernet import ethernet, ETHER_BROADCAST
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.packet.arp import arp
+from pox.lib.addresses import IPAddr, EthAddr, parse_cidr
+from pox.lib.util import str_to_bool, dpid_to_str, str_to_dpid
+
+import pox.openflow.libopenflow_01 as of
+
+import time
+
+try:
+  from .lb_strategies import make_strategy
+  from .flow_memory import FlowMemory
+  from .health_check import HealthChecker
+except ImportError:
+  # Loaded as a top-level module (e.g., from pox/ext)
+  from lb_strategies import make_strategy
+  from flow_memory import FlowMemory
+  from health_check import HealthChecker
+
+FLOW_IDLE_TIMEOUT = 10
+FLOW_MEMORY_TIMEOUT = 60 * 5
+
+# Cookie on the table entries we install, so we can find them in flow stats
+FLOW_COOKIE = 0x1b1b
+
+# Cookie on the per-bucket and per-client entries of proactive mode
+PROACTIVE_COOKIE = 0x1b1c
+
+# Forget about a SYN if the server hasn't answered it in this long
+HANDSHAKE_TIMEOUT = 5
+
+
+
+class MemoryEntry (object):
+  """
+  Record for flows we are balancing
+
+  Table entries in the switch "remember" flows for a period of time, but
+  rather than set their expirations to some long value (potentially leading
+  to lots of rules for dead connections), we let them expire from the
+  switch relatively quickly and remember them here in the controller for
+  longer.
+
+  Another tactic would be to increase the timeouts on the switch and use
+  the Nicira extension which can match packets with FIN set to remove them
+  when the connection closes.
+
+  There can be a lot of these, so they only hold the flow's keys in both
+  directions (see flow_key()), the server and the client's port.
+  """
+  __slots__ = ('server', 'client_port', 'key1', 'key2', 'timeout')
+
+  def __init__ (self, server, key, client_port):
+    self.server = server
+    self.client_port = client_port
+    self.key1 = key
+    # Same flow as the server sees it: server,client,dstport,srcport
+    self.key2 = ((server.toUnsigned() << 64)
+                 | ((key >> 32) & 0xffffffff00000000)
+                 | ((key & 0xffff) << 16) | ((key >> 16) & 0xffff))
+    self.refresh()
+
+  def refresh (self):
+    self.timeout = time.time() + FLOW_MEMORY_TIMEOUT
+
+  @property
+  def is_expired (self):
+    return time.time() > self.timeout
+
+
+def flow_key (ipp, tcpp):
+  """
+  Pack srcip,dstip,srcport,dstport into a single int
+  """
+  return ((ipp.srcip.toUnsigned() << 64) | (ipp.dstip.toUnsigned() << 32)
+          | (tcpp.srcport << 16) | tcpp.dstport)
+
+
+class iplb (object):
+  """
+  A simple IP load balancer
+
+  Give it a service_ip and a list of server IP addresses.  New TCP flows
+  to service_ip will be redirected to one of the servers as chosen by
+  the selection strategy (see lb_strategies).
+
+  We probe the servers to see if they're alive (see health_check).  By
+  default this is just ARP.
+
+  If the strategy balances on measured load, we also poll the switch for
+  stats on the flows we installed and work out each server's number of
+  active flows and byte rate from them.
+  """
+  def __init__ (self, connection, service_ip, servers = [], strategy = None,
+                stats_interval = 2, proactive = None, buckets = 16,
+                health = None):
+    self.service_ip = IPAddr(service_ip)
+    self.servers = [IPAddr(a) for a in servers]
+    self.con = connection
+    self.mac = self.con.eth_addr
+    self.live_servers = {} # IP -> MAC,port
+
+    # The strategy is told about servers as they come up and go down, so
+    # it starts out empty.
+    if strategy is None:
+      strategy = make_strategy('random')
+    self.strategy = strategy
+
+    try:
+      self.log = log.getChild(dpid_to_str(self.con.dpid))
+    except:
+      # Be nice to Python 2.6 (ugh)
+      self.log = log
+
+    # Options for the HealthChecker (mode, interval, rise, fall, ...)
+    self.health = HealthChecker(self, self.servers, **(health or {}))
+
+    # We remember where we directed flows so that if they start up again,
+    # we can send them to the same server if it's still up.  (The hash
+    # strategies send a flow back to the same server even if we forgot it.)
+    self.memory = FlowMemory(FLOW_MEMORY_TIMEOUT) # flow_key -> MemoryEntry
+
+    # New connections waiting for the server's SYN-ACK, so we can tell the
+    # strategy how long it took (only if it cares).
+    self.handshakes = {} # MemoryEntry.key2 -> (server,time of SYN)
+
+    # Load as seen by the switch (only kept up if the strategy wants it)
+    self.stats_interval = stats_interval
+    self.server_flows = {} # IP -> active flows
+    self.server_byte_rates = {} # IP -> bytes/sec
+    self._flow_bytes = {} # (nw_src,nw_dst,tp_src,tp_dst) -> byte_count
+    self._stats_time = None
+
+    # Proactive mode
+    self.buckets = None # Bucket -> (network,prefix length)
+    self.bucket_servers = None # Bucket -> IP of server or None
+    self.clients = {} # Client IP -> port
+    self._client_probes = set() # Client IPs we've ARPed for
+    if proactive is not None:
+      self._make_buckets(proactive, buckets)
+
+    self._do_probe() # Kick off the probing
+    if self.strategy.uses_flow_stats:
+      self._do_stats()
+
+    # As part of a gross hack, we now do this from elsewhere
+    #self.con.addListeners(self)
+
+  def _server_up (self, ip, mac, port):
+    self.live_servers[ip] = mac,port
+    self.strategy.add_server(ip)
+    if self.buckets is not None:
+      self._rebalance_buckets(refresh = ip)
+
+  def _server_down (self, ip):
+    del self.live_servers[ip]
+    self.strategy.remove_server(ip)
+    if self.buckets is not None:
+      self._rebalance_buckets()
+
+  def _make_buckets (self, prefix, count):
+    """
+    Split the client prefix into count smaller prefixes
+    """
+    net,bits = parse_cidr(prefix)
+    extra = max(0, int(count) - 1).bit_length()
+    if bits + extra > 32:
+      raise RuntimeError("Can't split %s into %s buckets" % (prefix, count))
+    base = net.toUnsigned()
+    self.buckets = [(IPAddr(base + (i << (32 - bits - extra))), bits + extra)
+                    for i in range(1 << extra)]
+    self.bucket_servers = [None] * len(self.buckets)
+
+  def _rebalance_buckets (self, refresh = None):
+    """
+    Hand out buckets to live servers in proportion to their weights
+
+    Buckets stay where they are unless their server is down or has more
+    than its share, so each change moves as few buckets as possible.
+    (Connections in a bucket that moves off a live server get reset.)
+
+    Buckets of the server refresh are reinstalled even if they didn't move
+    (e.g., because it showed up on a different port).
+    """
+    live = list(self.live_servers)
+    owned = {ip:[] for ip in live}
+    loose = []
+    for i,ip in enumerate(self.bucket_servers):
+      if ip in owned:
+        owned[ip].append(i)
+      else:
+        loose.append(i)
+
+    total = float(sum(max(1, self.strategy.weight(ip)) for ip in live))
+    share = {ip:len(self.buckets) * max(1, self.strategy.weight(ip)) / total
+             for ip in live}
+
+    # Take away from servers with more than their share...
+    for ip in live:
+      while len(owned[ip]) > share[ip] + 0.5:
+        loose.append(owned[ip].pop())
+
+    # ...and give to whoever is furthest under theirs
+    changed = []
+    for i in loose:
+      ip = None
+      if live:
+        ip = min(live, key = lambda ip: (len(owned[ip]) - share[ip]) / share[ip])
+        owned[ip].append(i)
+      if self.bucket_servers[i] != ip:
+        self.bucket_servers[i] = ip
+        changed.append(i)
+
+    if changed:
+      self.log.info("Moved %i of %i buckets", len(changed), len(self.buckets))
+    if refresh is not None:
+      changed = set(changed)
+      changed.update(owned.get(refresh, ()))
+    self._install_buckets(changed)
+
+  def _install_buckets (self, buckets = None):
+    """
+    Install the wildcard entries for some (or all) buckets
+    """
+    if buckets is None:
+      buckets = range(len(self.buckets))
+    for i in buckets:
+      net,bits = self.buckets[i]
+      match = of.ofp_match(dl_type = ethernet.IP_TYPE,
+                           nw_proto = ipv4.TCP_PROTOCOL,
+                           nw_src = "%s/%i" % (net, bits),
+                           nw_dst = self.service_ip)
+      server = self.bucket_servers[i]
+      if server is None:
+        # Let it come to us (and get dropped) until there's a server again
+        msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT, match=match)
+      else:
+        mac,port = self.live_servers[server]
+        msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
+                              cookie=PROACTIVE_COOKIE,
+                              match=match)
+        msg.actions.append(of.ofp_action_dl_addr.set_dst(mac))
+        msg.actions.append(of.ofp_action_nw_addr.set_dst(server))
+        msg.actions.append(of.ofp_action_output(port = port))
+      self.con.send(msg)
+
+  def _install_client (self, server, client, event):
+    """
+    Install the entry for return traffic from a server to a client
+
+    It's sent along with the packet which missed it.
+    """
+    msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
+                          cookie=PROACTIVE_COOKIE,
+                          idle_timeout=FLOW_MEMORY_TIMEOUT,
+                          hard_timeout=of.OFP_FLOW_PERMANENT,
+                          data=event.ofp)
+    msg.match = of.ofp_match(dl_type = ethernet.IP_TYPE,
+                             nw_proto = ipv4.TCP_PROTOCOL,
+                             nw_src = server, nw_dst = client)
+    msg.actions.append(of.ofp_action_dl_addr.set_src(self.mac))
+    msg.actions.append(of.ofp_action_nw_addr.set_src(self.service_ip))
+    msg.actions.append(of.ofp_action_output(port = self.clients[client]))
+    self.con.send(msg)
+
+  def set_weight (self, ip, weight):
+    """
+    Change a server's weight while we're running
+
+    Only strategies which use weights care.  From the POX console:
+      core.iplb.set_weight("10.0.0.1", 3)
+    """
+    self.strategy.set_weight(IPAddr(ip), int(weight))
+
+  def _do_expire (self):
+    """
+    Expire "memorized" flows
+
+    These should only have a limited lifetime.
+    """
+    t = time.time()
+
+    # Expire old flows
+    expired = self.memory.expire(t)
+    for entry in expired:
+      self.strategy.flow_ended(entry.server)
+    if expired:
+      self.log.debug("Expired %i flows", len(expired))
+
+    # Give up on unanswered SYNs
+    if self.handshakes:
+      self.handshakes = {k:v for k,v in self.handshakes.items()
+                         if t - v[1] < HANDSHAKE_TIMEOUT}
+
+  def _do_probe (self):
+    """
+    Probe all the servers to see if they're still up
+    """
+    self._do_expire()
+    self.health.probe_all()
+    core.callDelayed(self.health.interval, self._do_probe)
+
+  def _send_arp (self, ip):
+    """
+    Flood an ARP request for ip from the service IP
+    """
+    r = arp()
+    r.hwtype = r.HW_TYPE_ETHERNET
+    r.prototype = r.PROTO_TYPE_IP
+    r.opcode = r.REQUEST
+    r.hwdst = ETHER_BROADCAST
+    r.protodst = ip
+    r.hwsrc = self.mac
+    r.protosrc = self.service_ip
+    e = ethernet(type=ethernet.ARP_TYPE, src=self.mac,
+                 dst=ETHER_BROADCAST)
+    e.set_payload(r)
+    msg = of.ofp_packet_out()
+    msg.data = e.pack()
+    msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
+    msg.in_port = of.OFPP_NONE
+    self.con.send(msg)
+
+  def _do_stats (self):
+    """
+    Ask the switch for flow stats
+    """
+    msg = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+    self.con.send(msg)
+    core.callDelayed(self.stats_interval, self._do_stats)
+
+  def _handle_FlowStatsReceived (self, event):
+    """
+    Work out per-server load from the stats of our own flows
+
+    Forward flows (client -> service IP) count as the server's active flows.
+    Bytes in both directions count towards its byte rate.
+    """
+    now = time.time()
+    elapsed = now - self._stats_time if self._stats_time else None
+    self._stats_time = now
+
+    flows = dict.fromkeys(self.live_servers, 0)
+    byte_rates = dict.fromkeys(self.live_servers, 0.0)
+    flow_bytes = {}
+    for f in event.stats:
+      if f.cookie != FLOW_COOKIE: continue
+      m = f.match
+      if m.nw_dst == self.service_ip:
+        server = None
+        for a in f.actions:
+          if a.type == of.OFPAT_SET_NW_DST:
+            server = a.nw_addr
+        if server not in flows: continue
+        flows[server] += 1
+      elif m.nw_src in flows:
+        server = m.nw_src
+      else:
+        continue
+
+      k = m.nw_src,m.nw_dst,m.tp_src,m.tp_dst
+      flow_bytes[k] = f.byte_count
+      last = self._flow_bytes.get(k, 0)
+      # A smaller count means the entry expired and got reinstalled
+      delta = f.byte_count - last if f.byte_count >= last else f.byte_count
+      if elapsed:
+        byte_rates[server] += delta / elapsed
+    self._flow_bytes = flow_bytes
+
+    self.server_flows = flows
+    self.server_byte_rates = byte_rates
+    self.strategy.update_load(flows, byte_rates)
+
+  def _pick_server (self, key, inport):
+    """
+    Pick a server for a (hopefully) new connection
+    """
+    return self.strategy.pick(key)
+
+  def _handle_PacketIn (self, event):
+    inport = event.port
+    packet = event.parsed
+
+    def drop ():
+      if event.ofp.buffer_id is not None:
+        # Kill the buffer
+        msg = of.ofp_packet_out(data = event.ofp)
+        self.con.send(msg)
+      return None
+
+    tcpp = packet.find('tcp')
+    if not tcpp:
+      arpp = packet.find('arp')
+      if arpp:
+        # Handle replies to our server-liveness probes
+        if arpp.opcode == arpp.REPLY:
+          if arpp.protosrc in self.health.health:
+            self.health.arp_reply(arpp.protosrc, arpp.hwsrc, inport)
+          elif arpp.protosrc in self._client_probes:
+            # We asked where a client was for proactive mode
+            self._client_probes.discard(arpp.protosrc)
+            self.clients[arpp.protosrc] = inport
+        elif (arpp.opcode == arpp.REQUEST and self.buckets is not None
+              and arpp.protodst == self.service_ip):
+          # A client looking for us; now we know where it is
+          self.clients[arpp.protosrc] = inport
+        return
+
+      # Not TCP and not ARP.  Don't know what to do with this.  Drop it.
+      return drop()
+
+    # It's TCP.
+
+    ipp = packet.find('ipv4')
+
+    if ipp.srcip in self.servers and ipp.dstip == self.service_ip:
+      # Servers only talk to the service IP to answer health checks
+      if not self.health.tcp_reply(ipp, tcpp):
+        return drop()
+
+    elif ipp.srcip in self.servers:
+      # It's FROM one of our balanced servers.
+      # Rewrite it BACK to the client
+
+      fkey = flow_key(ipp, tcpp)
+      entry = self.memory.get(fkey)
+
+      if tcpp.SYN and tcpp.ACK and fkey in self.handshakes:
+        server,syn_time = self.handshakes.pop(fkey)
+        self.strategy.observe_latency(server, time.time() - syn_time)
+
+      if entry is None and self.buckets is not None:
+        # Proactive mode, so it's probably the reply to a new connection.
+        if ipp.dstip in self.clients:
+          self._install_client(ipp.srcip, ipp.dstip, event)
+          return
+        # We don't know where the client is yet.  Find out; TCP will
+        # retransmit.
+        self._client_probes.add(ipp.dstip)
+        self._send_arp(ipp.dstip)
+        return drop()
+
+      if entry is None:
+        # We either didn't install it, or we forgot about it.
+        self.log.debug("No client for %s", (ipp.srcip,ipp.dstip,
+                                            tcpp.srcport,tcpp.dstport))
+        return drop()
+
+      # Refresh time timeout and reinstall.
+      entry.refresh()
+
+      #self.log.debug("Install reverse flow for %s", key)
+
+      # Install reverse table entry
+      mac,port = self.live_servers[entry.server]
+
+      actions = []
+      actions.append(of.ofp_action_dl_addr.set_src(self.mac))
+      actions.append(of.ofp_action_nw_addr.set_src(self.service_ip))
+      actions.append(of.ofp_action_output(port = entry.client_port))
+      match = of.ofp_match.from_packet(packet, inport)
+
+      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
+                            cookie=FLOW_COOKIE,
+                            idle_timeout=FLOW_IDLE_TIMEOUT,
+                            hard_timeout=of.OFP_FLOW_PERMANENT,
+                            data=event.ofp,
+                            actions=actions,
+                            match=match)
+      self.con.send(msg)
+
+    elif ipp.dstip == self.service_ip:
+      # Ah, it's for our service IP and needs to be load balanced
+
+      if self.buckets is not None:
+        self.clients[ipp.srcip] = inport
+
+      # Do we already know this flow?
+      fkey = flow_key(ipp, tcpp)
+      entry = self.memory.get(fkey)
+      if entry is None or entry.server not in self.live_servers:
+        # Don't know it (hopefully it's new!)
+        if len(self.live_servers) == 0:
+          self.log.warn("No servers!")
+          return drop()
+
+        # Pick a server for this flow
+        key = ipp.srcip,ipp.dstip,tcpp.srcport,tcpp.dstport
+        server = self._pick_server(key, inport)
+        self.log.debug("Directing traffic to %s", server)
+        entry = MemoryEntry(server, fkey, inport)
+        self.memory.add(entry)
+        self.strategy.flow_started(server)
+        if self.strategy.uses_latency and tcpp.SYN and not tcpp.ACK:
+          self.handshakes[entry.key2] = server,time.time()
+
+      # Update timestamp
+      entry.refresh()
+
+      # Set up table entry towards selected server
+      mac,port = self.live_servers[entry.server]
+
+      actions = []
+      actions.append(of.ofp_action_dl_addr.set_dst(mac))
+      actions.append(of.ofp_action_nw_addr.set_dst(entry.server))
+      actions.append(of.ofp_action_output(port = port))
+      match = of.ofp_match.from_packet(packet, inport)
+
+      msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
+                            cookie=FLOW_COOKIE,
+                            idle_timeout=FLOW_IDLE_TIMEOUT,
+                            hard_timeout=of.OFP_FLOW_PERMANENT,
+                            data=event.ofp,
+                            actions=actions,
+                            match=match)
+      self.con.send(msg)
+
+
+def _parse_weights (servers, weights):
+  """
+  Turn "W1,W2,..." into a dict keyed by server
+  """
+  if not weights:
+    return {}
+  weights = [int(x) for x in str(weights).replace(","," ").split()]
+  if len(weights) != len(servers):
+    raise RuntimeError("Got %i weights for %i servers"
+                       % (len(weights), len(servers)))
+  return dict(zip(servers, weights))
+
+
+# Remember which DPID we're operating on (first one to connect)
+_dpid = None
+
+
+def launch (ip, servers, strategy = 'random', weights = None, dpid = None,
+            stats_interval = 2, proactive = None, buckets = 16,
+            health = 'arp', health_port = 80, health_path = '/',
+            probe_interval = 1, probe_timeout = 0.5, rise = 2, fall = 3):
+  global _dpid
+  if dpid is not None:
+    _dpid = str_to_dpid(dpid)
+
+  servers = servers.replace(","," ").split()
+  servers = [IPAddr(x) for x in servers]
+  ip = IPAddr(ip)
+
+  weights = _parse_weights(servers, weights)
+  stats_interval = float(stats_interval)
+  buckets = int(buckets)
+  health = dict(mode = health, port = int(health_port), path = health_path,
+                interval = float(probe_interval),
+                timeout = float(probe_timeout),
+                rise = int(rise), fall = int(fall))
+  strategy_name = strategy
+  # Fail now rather than when the switch connects
+  make_strategy(strategy_name, weights)
+
+
+  # We only want to enable ARP Responder *only* on the load balancer switch,
+  # so we do some disgusting hackery and then boot it up.
+  from proto.arp_responder import ARPResponder
+  old_pi = ARPResponder._handle_PacketIn
+  def new_pi (self, event):
+    if event.dpid == _dpid:
+      # Yes, the packet-in is on the right switch
+      return old_pi(self, event)
+  ARPResponder._handle_PacketIn = new_pi
+
+  # Hackery done.  Now start it.
+  from proto.arp_responder import launch as arp_launch
+  arp_launch(eat_packets=False,**{str(ip):True})
+  import logging
+  logging.getLogger("proto.arp_responder").setLevel(logging.WARN)
+
+
+  def _handle_ConnectionUp (event):
+    global _dpid
+    if _dpid is None:
+      _dpid = event.dpid
+
+    if _dpid != event.dpid:
+      log.warn("Ignoring switch %s", event.connection)
+    else:
+      if not core.hasComponent('iplb'):
+        # Need to initialize first...
+        core.registerNew(iplb, event.connection, IPAddr(ip), servers,
+                         make_strategy(strategy_name, weights),
+                         stats_interval, proactive, buckets, health)
+        log.info("IP Load Balancer Ready (%s).", strategy_name)
+      log.info("Load Balancing on %s", event.connection)
+
+      # Gross hack
+      core.iplb.con = event.connection
+      event.connection.addListeners(core.iplb)
+      if core.iplb.buckets is not None:
+        # In case the switch reconnected and lost them
+        core.iplb._install_buckets([i for i,ip in
+                                    enumerate(core.iplb.bucket_servers)
+                                    if ip is not None])
+
+
+  core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
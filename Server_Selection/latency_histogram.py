@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+"""
+Latency histograms for the measurement scripts.
+
+A Histogram counts latencies in log-linear buckets, like HdrHistogram:
+values are kept in microseconds with SUB_BITS bits of precision (buckets
+are at most 1/2^(SUB_BITS - 1) wide, so up to about 1.6% error with the
+default), so its size depends on the range of latencies seen and not on
+how many there were.  Histograms from several
+runs or clients can be merged, and saved to / loaded from JSON.
+
+LatencyLog keeps one histogram for the whole run plus one per second.
+
+Run it on saved files to merge them and print the percentiles:
+  python3 latency_histogram.py rr.json wrr.json
+"""
+
+import json
+import sys
+
+SUB_BITS = 7
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    def __init__(self, sub_bits=SUB_BITS):
+        self.sub_bits = sub_bits
+        self.counts = {}  # Bucket index -> count
+        self.count = 0
+        self.total = 0  # Sum of values, in microseconds
+        self.min = None
+        self.max = None
+
+    def _index(self, us):
+        shift = us.bit_length() - self.sub_bits
+        if shift <= 0:
+            return us
+        return (shift << (self.sub_bits - 1)) + (us >> shift)
+
+    def _highest(self, index):
+        ''' Largest value (in microseconds) that lands in the bucket '''
+        if index < (1 << self.sub_bits):
+            return index
+        shift = (index >> (self.sub_bits - 1)) - 1
+        mantissa = index - (shift << (self.sub_bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds, n=1):
+        us = max(0, int(seconds * 1e6))
+        i = self._index(us)
+        self.counts[i] = self.counts.get(i, 0) + n
+        self.count += n
+        self.total += us * n
+        if self.min is None or us < self.min:
+            self.min = us
+        if self.max is None or us > self.max:
+            self.max = us
+
+    def merge(self, other):
+        if other.sub_bits != self.sub_bits:
+            raise ValueError("Can't merge histograms with different precision")
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentile(self, p):
+        ''' Latency in seconds that p percent of the samples are at or below '''
+        if not self.count:
+            return None
+        wanted = max(1, -(-self.count * p // 100))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= wanted:
+                return min(self._highest(i), self.max) / 1e6
+        return self.max / 1e6
+
+    def mean(self):
+        return self.total / self.count / 1e6 if self.count else None
+
+    def summary(self, prefix='', percentiles=PERCENTILES):
+        ''' Flat dict of count, mean, min, percentiles and max (in seconds) '''
+        s = {prefix + 'count': self.count,
+             prefix + 'mean': self.mean(),
+             prefix + 'min': self.min / 1e6 if self.count else None}
+        for p in percentiles:
+            s[prefix + 'p' + format(p, 'g')] = self.percentile(p)
+        s[prefix + 'max'] = self.max / 1e6 if self.count else None
+        return s
+
+    def to_dict(self):
+        return {'sub_bits': self.sub_bits, 'count': self.count,
+                'total_us': self.total, 'min_us': self.min, 'max_us': self.max,
+                'counts': {str(i): c for i, c in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d['sub_bits'])
+        h.counts = {int(i): c for i, c in d['counts'].items()}
+        h.count = d['count']
+        h.total = d['total_us']
+        h.min = d['min_us']
+        h.max = d['max_us']
+        return h
+
+
+class LatencyLog:
+    ''' A histogram for the whole run and one for each second of it '''
+
+    def __init__(self, start, sub_bits=SUB_BITS):
+        self.start = start
+        self.sub_bits = sub_bits
+        self.total = Histogram(sub_bits)
+        self.seconds = {}  # Seconds since start -> Histogram
+
+    def record(self, start, latency):
+        self.total.record(latency)
+        second = int(start - self.start)
+        h = self.seconds.get(second)
+        if h is None:
+            h = self.seconds[second] = Histogram(self.sub_bits)
+        h.record(latency)
+
+    def merge(self, other):
+        ''' Merge another run; seconds are lined up from each run's start '''
+        self.total.merge(other.total)
+        for second, h in other.seconds.items():
+            mine = self.seconds.get(second)
+            if mine is None:
+                mine = self.seconds[second] = Histogram(self.sub_bits)
+            mine.merge(h)
+        return self
+
+    def series(self, percentiles=(50, 99)):
+        ''' One row per second: requests and latency percentiles '''
+        rows = []
+        for second in sorted(self.seconds):
+            h = self.seconds[second]
+            row = {'second': second}
+            row.update(h.summary(percentiles=percentiles))
+            rows.append(row)
+        return rows
+
+    def to_dict(self):
+        return {'start': self.start, 'total': self.total.to_dict(),
+                'seconds': {str(s): h.to_dict() for s, h in sorted(self.seconds.items())}}
+
+    @classmethod
+    def from_dict(cls, d):
+        log = cls(d['start'], d['total']['sub_bits'])
+        log.total = Histogram.from_dict(d['total'])
+        log.seconds = {int(s): Histogram.from_dict(h) for s, h in d['seconds'].items()}
+        return log
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def format_summary(h):
+    s = h.summary()
+    if not s['count']:
+        return "no samples"
+    parts = [f"{k} {v * 1000:.2f}" for k, v in s.items() if k != 'count']
+    return f"{s['count']} samples, " + " ".join(parts) + " ms"
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    logs = [LatencyLog.load(path) for path in sys.argv[1:]]
+    for path, log in zip(sys.argv[1:], logs):
+        print(f"{path}: {format_summary(log.total)}")
+    if len(logs) > 1:
+        merged = LatencyLog(logs[0].start, logs[0].sub_bits)
+        for log in logs:
+            merged.merge(log)
+        print(f"merged: {format_summary(merged.total)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,597 @@
+"""
+Server selection strategies for the IP load balancer
+
+Each strategy only knows about the servers that are currently live.  The
+balancer tells it when servers come and go (add_server/remove_server) and
+when flows start and end (flow_started/flow_ended), and the strategy keeps
+whatever structure it needs up to date as those things happen.  That way
+pick() never has to look at the whole server list for a new flow.
+
+This module doesn't depend on POX, so it can be used (and timed) without a
+controller.
+"""
+
+import hashlib
+import heapq
+import random
+import zlib
+from collections import deque
+
+
+class Strategy (object):
+  """
+  Base class for server selection strategies
+  """
+  name = None
+
+  # Set if the balancer should poll the switch and call update_load()
+  uses_flow_stats = False
+
+  # Set if the balancer should time connection setup for observe_latency()
+  uses_latency = False
+
+  def __init__ (self, weights = None):
+    # Server -> weight.  Servers that aren't listed get a weight of 1.
+    self.weights = dict(weights) if weights else {}
+
+  def __len__ (self):
+    raise NotImplementedError()
+
+  def add_server (self, server):
+    """
+    A server has come up
+    """
+    raise NotImplementedError()
+
+  def remove_server (self, server):
+    """
+    A server has gone down
+    """
+    raise NotImplementedError()
+
+  def pick (self, key):
+    """
+    Pick a live server for a new flow
+
+    key is the flow's (srcip,dstip,srcport,dstport).
+    """
+    raise NotImplementedError()
+
+  def flow_started (self, server):
+    """
+    A new flow has been directed to server
+    """
+    pass
+
+  def flow_ended (self, server):
+    """
+    A flow to server has been forgotten
+    """
+    pass
+
+  def observe_latency (self, server, seconds):
+    """
+    We measured how long server took to respond
+    """
+    pass
+
+  def weight (self, server):
+    return self.weights.get(server, 1)
+
+  def set_weight (self, server, weight):
+    """
+    Change a server's weight
+    """
+    self.weights[server] = weight
+
+
+class RoundRobin (Strategy):
+  """
+  Hand out servers in turn
+
+  The live servers sit in a deque which we just rotate.
+  """
+  name = 'round_robin'
+
+  def __init__ (self, weights = None):
+    super(RoundRobin, self).__init__(weights)
+    self._ring = deque()
+
+  def __len__ (self):
+    return len(self._ring)
+
+  def add_server (self, server):
+    if server not in self._ring:
+      self._ring.append(server)
+
+  def remove_server (self, server):
+    try:
+      self._ring.remove(server)
+    except ValueError:
+      pass
+
+  def pick (self, key):
+    server = self._ring[0]
+    self._ring.rotate(-1)
+    return server
+
+
+class WeightedRoundRobin (Strategy):
+  """
+  Smooth weighted round-robin
+
+  Rather than handing a server all of its turns in a row, turns are spread
+  out evenly: a server with weight w is due every 1/w units of "virtual
+  time", and we always pick whoever is due soonest.  With weights 5,1,1
+  that gives a a b a c a a rather than a a a a a b c -- the same sequence
+  nginx's smooth weighted round-robin aims for, but kept in a heap so a
+  pick is O(log n) instead of a walk over every server.  If every server
+  started at the same point they would all fall due together, so each new
+  server's first deadline is staggered by a golden-ratio phase.
+
+  Each live server has one current heap entry.  Changing a weight or
+  removing a server just makes its entry stale; stale entries are skipped
+  when they reach the top.
+  """
+  name = 'weighted'
+
+  def __init__ (self, weights = None):
+    super(WeightedRoundRobin, self).__init__(weights)
+    self._heap = [] # (deadline, seq, server)
+    self._current = {} # Live server -> seq of its current heap entry
+    self._seq = 0
+    self._now = 0.0 # Virtual time of the last pick
+    self._phase = 0.0
+
+  def __len__ (self):
+    return len(self._current)
+
+  def _interval (self, server):
+    return 1.0 / max(1, self.weight(server))
+
+  def _schedule (self, server, deadline):
+    self._seq += 1
+    self._current[server] = self._seq
+    heapq.heappush(self._heap, (deadline, self._seq, server))
+    if len(self._heap) > 2 * len(self._current) + 64:
+      self._heap = [e for e in self._heap if self._current.get(e[2]) == e[1]]
+      heapq.heapify(self._heap)
+
+  def add_server (self, server):
+    if server not in self._current:
+      # It gets its first turn somewhere within one interval from now, so
+      # a server coming up doesn't get a burst of new flows.
+      self._phase = (self._phase + 0.6180339887) % 1.0
+      self._schedule(server,
+                     self._now + self._interval(server) * self._phase)
+
+  def remove_server (self, server):
+    self._current.pop(server, None)
+
+  def set_weight (self, server, weight):
+    super(WeightedRoundRobin, self).set_weight(server, weight)
+    if server in self._current:
+      self._schedule(server, self._now + self._interval(server))
+
+  def pick (self, key):
+    heap = self._heap
+    while True:
+      deadline, seq, server = heap[0]
+      if self._current.get(server) == seq: break
+      heapq.heappop(heap)
+    self._now = deadline
+    self._seq += 1
+    self._current[server] = self._seq
+    heapq.heapreplace(heap, (deadline + self._interval(server), self._seq,
+                             server))
+    return server
+
+
+class LeastConnection (Strategy):
+  """
+  Pick the server with the fewest flows
+
+  Connection counts live in a min-heap.  Rather than fixing up entries in
+  place, every change pushes a fresh (count,seq,server) entry and stale ones
+  are thrown away when they reach the top.  The sequence number breaks ties
+  in favor of whoever has been waiting longest.
+  """
+  name = 'least_conn'
+
+  def __init__ (self, weights = None):
+    super(LeastConnection, self).__init__(weights)
+    self.counts = {} # Live server -> number of flows
+    self._heap = []
+    self._seq = 0
+
+  def __len__ (self):
+    return len(self.counts)
+
+  def _push (self, server):
+    self._seq += 1
+    heapq.heappush(self._heap, (self.counts[server], self._seq, server))
+    if len(self._heap) > 2 * len(self.counts) + 64:
+      self._compact()
+
+  def _compact (self):
+    self._heap = [(c, i, s) for i, (s, c) in enumerate(self.counts.items())]
+    heapq.heapify(self._heap)
+    self._seq = len(self._heap)
+
+  def add_server (self, server):
+    if server not in self.counts:
+      self.counts[server] = 0
+      self._push(server)
+
+  def remove_server (self, server):
+    # Its heap entries go stale and get discarded lazily
+    self.counts.pop(server, None)
+
+  def pick (self, key):
+    heap = self._heap
+    while True:
+      count, _, server = heap[0]
+      if self.counts.get(server) == count:
+        return server
+      heapq.heappop(heap)
+
+  def flow_started (self, server):
+    if server in self.counts:
+      self.counts[server] += 1
+      self._push(server)
+
+  def flow_ended (self, server):
+    if self.counts.get(server, 0) > 0:
+      self.counts[server] -= 1
+      self._push(server)
+
+
+class LeastLoad (Strategy):
+  """
+  Pick the server with the least measured load
+
+  Unlike LeastConnection, the load doesn't come from our own bookkeeping but
+  from the switch: the balancer polls flow stats for the flows it installed
+  and hands us per-server numbers with update_load().  Between polls, each
+  flow we hand out is charged to its server at an estimated per-flow rate
+  so that we don't send everything to the same server until the next poll.
+
+  Load is divided by weight, so weights still work.  This one balances on
+  the number of active flows; LeastBytes balances on byte rate.
+  """
+  name = 'least_load'
+  metric = 'flows'
+  uses_flow_stats = True
+
+  def __init__ (self, weights = None):
+    super(LeastLoad, self).__init__(weights)
+    self.load = {} # Live server -> load as of the last poll
+    self._extra = {} # Live server -> load we've added since then
+    self._unit = 1.0 # What we charge for one new flow
+    self._heap = [] # (load, seq, server)
+    self._current = {} # Live server -> seq of its current heap entry
+    self._seq = 0
+
+  def __len__ (self):
+    return len(self.load)
+
+  def _score (self, server):
+    load = self.load[server] + self._extra[server]
+    return load / max(1, self.weight(server))
+
+  def _push (self, server):
+    self._seq += 1
+    self._current[server] = self._seq
+    heapq.heappush(self._heap, (self._score(server), self._seq, server))
+    if len(self._heap) > 2 * len(self._current) + 64:
+      self._rebuild()
+
+  def _rebuild (self):
+    self._heap = []
+    for server in self.load:
+      self._seq += 1
+      self._current[server] = self._seq
+      self._heap.append((self._score(server), self._seq, server))
+    heapq.heapify(self._heap)
+
+  def add_server (self, server):
+    if server not in self.load:
+      self.load[server] = 0.0
+      self._extra[server] = 0.0
+      self._push(server)
+
+  def remove_server (self, server):
+    self.load.pop(server, None)
+    self._extra.pop(server, None)
+    self._current.pop(server, None)
+
+  def set_weight (self, server, weight):
+    super(LeastLoad, self).set_weight(server, weight)
+    if server in self.load:
+      self._push(server)
+
+  def pick (self, key):
+    heap = self._heap
+    while True:
+      _, seq, server = heap[0]
+      if self._current.get(server) == seq:
+        return server
+      heapq.heappop(heap)
+
+  def flow_started (self, server):
+    if server in self.load:
+      self._extra[server] += self._unit
+      self._push(server)
+
+  def update_load (self, flows, byte_rates):
+    """
+    Take fresh numbers from the switch
+
+    flows and byte_rates map servers to their number of active flows and
+    bytes per second.
+    """
+    if self.metric == 'bytes':
+      loads = byte_rates
+      total_flows = sum(flows.values())
+      if total_flows:
+        self._unit = max(1.0, sum(byte_rates.values()) / total_flows)
+    else:
+      loads = flows
+      self._unit = 1.0
+    for server in self.load:
+      self.load[server] = float(loads.get(server, 0))
+      self._extra[server] = 0.0
+    self._rebuild()
+
+
+class LeastBytes (LeastLoad):
+  """
+  Pick the server with the lowest measured byte rate
+  """
+  name = 'least_bytes'
+  metric = 'bytes'
+
+
+class Random (Strategy):
+  """
+  Pick a live server at random
+
+  Servers are kept in a list plus an index so we can remove them by
+  swapping with the last element.
+  """
+  name = 'random'
+
+  def __init__ (self, weights = None):
+    super(Random, self).__init__(weights)
+    self._servers = []
+    self._index = {} # Server -> position in _servers
+
+  def __len__ (self):
+    return len(self._servers)
+
+  def add_server (self, server):
+    if server not in self._index:
+      self._index[server] = len(self._servers)
+      self._servers.append(server)
+
+  def remove_server (self, server):
+    i = self._index.pop(server, None)
+    if i is None: return
+    last = self._servers.pop()
+    if last != server:
+      self._servers[i] = last
+      self._index[last] = i
+
+  def pick (self, key):
+    return self._servers[random.randrange(len(self._servers))]
+
+
+class LeastLatency (Strategy):
+  """
+  Power of two choices, weighted by response time
+
+  For each new flow, two live servers are picked at random and the one
+  with the lower latency * (active flows + 1) / weight gets it.  Latency is
+  a moving average of what the balancer measures (the time from a new
+  connection's SYN to the server's SYN-ACK, and TCP/HTTP health check
+  round trips).  A server we haven't measured yet counts as fast, so it
+  gets tried.
+
+  Comparing two random servers rather than all of them keeps a pick O(1)
+  and avoids everyone piling onto whichever server looked best last.
+  """
+  name = 'least_latency'
+  uses_latency = True
+
+  # Weight of the newest sample in the moving average
+  ALPHA = 0.3
+
+  def __init__ (self, weights = None):
+    super(LeastLatency, self).__init__(weights)
+    self._servers = []
+    self._index = {} # Server -> position in _servers
+    self.latency = {} # Server -> seconds (moving average)
+    self.active = {} # Live server -> number of flows
+
+  def __len__ (self):
+    return len(self._servers)
+
+  def add_server (self, server):
+    if server not in self._index:
+      self._index[server] = len(self._servers)
+      self._servers.append(server)
+      self.active[server] = 0
+
+  def remove_server (self, server):
+    i = self._index.pop(server, None)
+    if i is None: return
+    self.active.pop(server, None)
+    last = self._servers.pop()
+    if last != server:
+      self._servers[i] = last
+      self._index[last] = i
+
+  def _score (self, server):
+    return (self.latency.get(server, 0.0) * (self.active[server] + 1)
+            / max(1, self.weight(server)))
+
+  def pick (self, key):
+    n = len(self._servers)
+    if n == 1:
+      return self._servers[0]
+    i = random.randrange(n)
+    j = random.randrange(n - 1)
+    if j >= i: j += 1
+    a = self._servers[i]
+    b = self._servers[j]
+    return a if self._score(a) <= self._score(b) else b
+
+  def flow_started (self, server):
+    if server in self.active:
+      self.active[server] += 1
+
+  def flow_ended (self, server):
+    if self.active.get(server, 0) > 0:
+      self.active[server] -= 1
+
+  def observe_latency (self, server, seconds):
+    old = self.latency.get(server)
+    if old is None:
+      self.latency[server] = seconds
+    else:
+      self.latency[server] = old + self.ALPHA * (seconds - old)
+
+
+class Hash (Strategy):
+  """
+  Consistent hashing with a Maglev lookup table
+
+  Each server gets a pseudo-random permutation of the table slots which
+  depends only on its address, and the servers take turns claiming their
+  next preferred free slot until the table is full (servers with a bigger
+  weight claim more slots per turn).  A flow is hashed to a slot and goes
+  to that slot's server.
+
+  The table is always TABLE_SIZE slots, and nothing depends on the order
+  servers came up in, on which servers were there before, or on Python's
+  per-process hash seed, so the same server list always gives the same
+  table: a given flow maps to the same server across memory expiry and
+  controller restarts.  When a server comes or goes, only about 1/N of
+  the slots change hands.
+
+  The table is rebuilt lazily on the first pick after a membership change,
+  so a burst of ups and downs costs a single rebuild.  Per-server
+  permutations are only computed once.
+  """
+  name = 'hash'
+
+  # Prime, and fixed, since changing the size reshuffles everything.  It
+  # gives each server the 100 slots or so it needs to get an even share
+  # with up to about 160 servers (or total weight); use a bigger prime for
+  # bigger pools.
+  TABLE_SIZE = 16381
+
+  def __init__ (self, weights = None, table_size = None):
+    super(Hash, self).__init__(weights)
+    self._servers = set()
+    self._perms = {} # Server -> (offset,skip)
+    self._size = table_size or self.TABLE_SIZE
+    self._table = None # Slot -> server; None when it needs a rebuild
+
+  def __len__ (self):
+    return len(self._servers)
+
+  def _flow_hash (self, key):
+    return zlib.crc32(str(key).encode())
+
+  def _perm (self, server):
+    p = self._perms.get(server)
+    if p is None:
+      d = hashlib.sha1(str(server).encode()).digest()
+      offset = int.from_bytes(d[:8], 'big') % self._size
+      skip = int.from_bytes(d[8:16], 'big') % (self._size - 1) + 1
+      p = self._perms[server] = offset,skip
+    return p
+
+  def _rebuild (self):
+    m = self._size
+    table = [None] * m
+    servers = sorted(self._servers, key = str)
+    perms = [self._perm(server) for server in servers]
+    turns = [max(1, self.weight(server)) for server in servers]
+    nexts = [0] * len(servers)
+    filled = 0
+    while filled < m:
+      for i,server in enumerate(servers):
+        offset,skip = perms[i]
+        for _ in range(turns[i]):
+          j = nexts[i]
+          c = (offset + j * skip) % m
+          while table[c] is not None:
+            j += 1
+            c = (offset + j * skip) % m
+          table[c] = server
+          nexts[i] = j + 1
+          filled += 1
+          if filled == m: break
+        if filled == m: break
+    self._table = table
+
+  def add_server (self, server):
+    if server not in self._servers:
+      self._servers.add(server)
+      self._table = None
+
+  def remove_server (self, server):
+    if server in self._servers:
+      self._servers.remove(server)
+      self._table = None
+
+  def set_weight (self, server, weight):
+    super(Hash, self).set_weight(server, weight)
+    self._table = None
+
+  def pick (self, key):
+    if self._table is None:
+      self._rebuild()
+    return self._table[self._flow_hash(key) % self._size]
+
+
+class SourceHash (Hash):
+  """
+  Consistent hashing on the client's IP address
+
+  All of a client's flows go to the same server.
+  """
+  name = 'source_hash'
+
+  def _flow_hash (self, key):
+    return zlib.crc32(str(key[0]).encode())
+
+
+STRATEGIES = {}
+for _cls in (RoundRobin, WeightedRoundRobin, LeastConnection, LeastLoad,
+             LeastBytes, LeastLatency, Random, Hash, SourceHash):
+  STRATEGIES[_cls.name] = _cls
+del _cls
+
+# Some shorter (or older) names
+STRATEGIES['rr'] = RoundRobin
+STRATEGIES['wrr'] = WeightedRoundRobin
+STRATEGIES['weighted_round_robin'] = WeightedRoundRobin
+STRATEGIES['lc'] = LeastConnection
+STRATEGIES['least_connection'] = LeastConnection
+STRATEGIES['maglev'] = Hash
+STRATEGIES['p2c'] = LeastLatency
+
+
+def make_strategy (name, weights = None):
+  """
+  Create a strategy by name
+  """
+  try:
+    cls = STRATEGIES[name.lower()]
+  except KeyError:
+    raise ValueError("Unknown strategy '%s' (try one of: %s)"
+                     % (name, ", ".join(sorted(STRATEGIES))))
+  return cls(weights = weights)
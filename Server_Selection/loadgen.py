@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+
+"""
+Concurrent HTTP load generator for the load balancer's service IP.
+
+Two ways to drive the load:
+
+  closed  --concurrency workers each send a request, wait for the answer
+          and send the next one.  Good for finding maximum throughput.
+  open    Requests start at a fixed --rate (per second) whatever happens to
+          the earlier ones, spread over up to --concurrency connections.
+          Latency is measured from when a request was *supposed* to start,
+          so a slow balancer can't hide its queueing delay.
+
+Every worker thread keeps its own keep-alive connection, so we measure the
+balancer and servers rather than TCP setup in the client.  Results from the
+first --warmup seconds are thrown away.
+
+Example (from the client host):
+  python3 loadgen.py --url http://10.0.1.1/ --mode closed --concurrency 16 \\
+      --requests 5000 --warmup 2 --out results.json
+
+Results are printed and, with --out, written as JSON or CSV (by extension).
+Latencies go into a histogram (see latency_histogram.py) rather than a
+list, so long runs use constant memory; --hist saves it for merging with
+other runs, and --series writes per-second request counts and percentiles.
+"""
+
+import argparse
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from latency_histogram import LatencyLog
+
+
+class Recorder:
+    ''' Collects per-request results from all the workers '''
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.lock = threading.Lock()
+        self.latencies = LatencyLog(measure_from)
+        self.bytes = 0
+        self.errors = 0
+        self.first = None
+        self.last = None
+
+    def record(self, start, end, nbytes, ok):
+        if start < self.measure_from:
+            return  # Warmup
+        with self.lock:
+            if ok:
+                self.latencies.record(start, end - start)
+                self.bytes += nbytes
+            else:
+                self.errors += 1
+            if self.first is None or start < self.first:
+                self.first = start
+            if self.last is None or end > self.last:
+                self.last = end
+
+
+class LoadGenerator:
+    def __init__(self, url, concurrency=8, timeout=5.0):
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def session(self):
+        ''' One keep-alive connection per thread '''
+        s = getattr(self.local, 'session', None)
+        if s is None:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            self.local.session = s
+        return s
+
+    def request(self, recorder, start=None):
+        ''' Send one request; start is when it should have been sent '''
+        if start is None:
+            start = time.time()
+        try:
+            response = self.session().get(self.url, timeout=self.timeout)
+            nbytes = len(response.content)
+            ok = response.status_code < 500
+        except requests.RequestException:
+            nbytes = 0
+            ok = False
+        recorder.record(start, time.time(), nbytes, ok)
+
+    def run_closed(self, recorder, requests_count=None, deadline=None):
+        remaining = [requests_count]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                if deadline is not None and time.time() >= deadline:
+                    return
+                if requests_count is not None:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.request(recorder)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def run_open(self, recorder, rate, requests_count=None, deadline=None):
+        interval = 1.0 / rate
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            t0 = time.time()
+            sent = 0
+            while True:
+                due = t0 + sent * interval
+                if deadline is not None and due >= deadline:
+                    break
+                if requests_count is not None and sent >= requests_count:
+                    break
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.request, recorder, due)
+                sent += 1
+
+
+def run(url, mode='closed', concurrency=8, requests_count=None, duration=None,
+        rate=None, warmup=0.0, timeout=5.0):
+    '''
+    Run one load test and return a summary dict
+
+    requests_count and/or duration bound the measured part of the run
+    (the warmup comes on top of them).
+    '''
+    return measure(url, mode, concurrency, requests_count, duration, rate,
+                   warmup, timeout)[0]
+
+
+def measure(url, mode='closed', concurrency=8, requests_count=None, duration=None,
+            rate=None, warmup=0.0, timeout=5.0):
+    '''
+    Like run(), but returns the LatencyLog of the run too
+    '''
+    if requests_count is None and duration is None:
+        raise ValueError("Need a number of requests or a duration")
+    if mode == 'open' and not rate:
+        raise ValueError("Open-loop mode needs a rate")
+
+    gen = LoadGenerator(url, concurrency, timeout)
+    start = time.time()
+    deadline = start + warmup + duration if duration is not None else None
+    # Warmup requests don't count towards the total
+    if requests_count is not None and warmup:
+        warmup_recorder = Recorder(float('inf'))
+        if mode == 'open':
+            gen.run_open(warmup_recorder, rate, deadline=start + warmup)
+        else:
+            gen.run_closed(warmup_recorder, deadline=start + warmup)
+        recorder = Recorder(time.time())
+    else:
+        recorder = Recorder(start + warmup)
+
+    if mode == 'open':
+        gen.run_open(recorder, rate, requests_count, deadline)
+    else:
+        gen.run_closed(recorder, requests_count, deadline)
+
+    result = summarize(recorder, url=url, mode=mode, concurrency=concurrency, rate=rate)
+    return result, recorder.latencies
+
+
+def summarize(recorder, **info):
+    hist = recorder.latencies.total
+    elapsed = (recorder.last - recorder.first) if recorder.first is not None else 0.0
+    result = dict(info)
+    result.update({
+        'requests': hist.count,
+        'errors': recorder.errors,
+        'elapsed': elapsed,
+        'throughput_rps': hist.count / elapsed if elapsed else 0.0,
+        'throughput_mbps': recorder.bytes * 8 / (elapsed * 1e6) if elapsed else 0.0,
+        'bytes': recorder.bytes,
+    })
+    result.update(hist.summary('latency_'))
+    del result['latency_count']
+    return result
+
+
+def write_results(results, path):
+    ''' Write a list of summary dicts as JSON or CSV (by file extension) '''
+    if path.endswith('.csv'):
+        fields = []
+        for r in results:
+            fields += [k for k in r if k not in fields]
+        with open(path, 'w', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=fields)
+            w.writeheader()
+            w.writerows(results)
+    else:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def print_result(r):
+    print(f"{r['mode']} loop, concurrency {r['concurrency']}"
+          + (f", rate {r['rate']}/s" if r['rate'] else ""))
+    print(f"  Requests: {r['requests']} ({r['errors']} errors) in {r['elapsed']:.2f} seconds")
+    print(f"  Throughput: {r['throughput_rps']:.1f} requests/s, {r['throughput_mbps']:.3f} Mbps")
+    if r['latency_mean'] is not None:
+        print("  Latency (ms): " + " ".join(f"{k[8:]} {v * 1000:.2f}"
+                                           for k, v in r.items() if k.startswith('latency_')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://10.0.1.1/')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, help="Number of requests to measure")
+    parser.add_argument('--duration', type=float, help="Seconds to measure for")
+    parser.add_argument('--rate', type=float, help="Requests per second (open loop)")
+    parser.add_argument('--warmup', type=float, default=0.0, help="Seconds of warmup")
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--out', help="Write results to this .json or .csv file")
+    parser.add_argument('--hist', help="Save the latency histogram to this .json file")
+    parser.add_argument('--series', help="Write per-second results to this .json or .csv file")
+    args = parser.parse_args()
+
+    if args.requests is None and args.duration is None:
+        parser.error("need --requests and/or --duration")
+    if args.mode == 'open' and not args.rate:
+        parser.error("open loop needs --rate")
+
+    result, log = measure(args.url, args.mode, args.concurrency, args.requests,
+                          args.duration, args.rate, args.warmup, args.timeout)
+    print_result(result)
+    if args.out:
+        write_results([result], args.out)
+    if args.hist:
+        log.save(args.hist)
+    if args.series:
+        write_results(log.series(), args.series)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
-import requests
-import time
-import matplotlib.pyplot as plt
+import argparse
+
+import loadgen
 
 service_ip = "10.0.1.1"  # Replace with the IP your load balancer uses
 url = f"http://{service_ip}/"
@@ -8,32 +8,51 @@ url = f"http://{service_ip}/"
 # List of different packet counts to test
 request_counts = [100, 500, 1000, 5000]
 
-# To store the average response time for each packet count
-average_response_times = []
+parser = argparse.ArgumentParser(description="Average response time vs. number of requests")
+parser.add_argument('--url', default=url)
+parser.add_argument('--concurrency', type=int, default=8)
+parser.add_argument('--rate', type=float,
+                    help="Send at this many requests/s (open loop) instead of closed loop")
+parser.add_argument('--warmup', type=float, default=1.0, help="Seconds of warmup before each run")
+parser.add_argument('--out', default='response_time.csv', help="Results file (.csv or .json)")
+parser.add_argument('--plot', help="Also save a plot to this image file")
+parser.add_argument('--hist', metavar='PREFIX',
+                    help="Save each run's latency histogram to PREFIX<count>.json")
+args = parser.parse_args()
 
+mode = 'open' if args.rate else 'closed'
+results = []
 for count in request_counts:
-    latencies = []  # Initialize latencies for the current packet count
-    
-    for i in range(count):  # Make 'count' number of requests
-        start_time = time.time()
-        response = requests.get(url)
-        end_time = time.time()
-        
-        latencies.append(end_time - start_time)
-
-       # print(f"Request {i+1}/{count} for packet count {count}: {end_time - start_time:.4f} seconds")
-    
-    # Calculate average response time for the current packet count
-    average_response_time = sum(latencies) / len(latencies)
-    average_response_times.append(average_response_time)
-    
-    print(f"Average response time for {count} requests: {average_response_time:.4f} seconds")
-
-# Plotting the average response time for different packet counts
-plt.plot(request_counts, average_response_times, marker='o')
-plt.title('Average HTTP Response Time vs Requests Count')
-plt.xlabel('Number of Packets')
-plt.ylabel('Average Response Time (seconds)')
-plt.grid(True)
-plt.show()
+    result, log = loadgen.measure(args.url, mode, args.concurrency, count,
+                                  rate=args.rate, warmup=args.warmup)
+    results.append(result)
+    if args.hist:
+        log.save(f"{args.hist}{count}.json")
+
+    if result['latency_mean'] is None:
+        print(f"No successful requests out of {count} ({result['errors']} errors)")
+        continue
+    print(f"Average response time for {count} requests: {result['latency_mean']:.4f} seconds")
+    print(f"  p50 {result['latency_p50']:.4f}  p90 {result['latency_p90']:.4f}  "
+          f"p99 {result['latency_p99']:.4f}  p99.9 {result['latency_p99.9']:.4f}  "
+          f"max {result['latency_max']:.4f} seconds")
+
+loadgen.write_results(results, args.out)
+
+if args.plot:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    def points(key):
+        # Runs with no successful requests are left out (NaN isn't drawn)
+        return [float('nan') if r[key] is None else r[key] for r in results]
 
+    plt.plot(request_counts, points('latency_mean'), marker='o', label='mean')
+    plt.plot(request_counts, points('latency_p99'), marker='o', label='p99')
+    plt.legend()
+    plt.title('Average HTTP Response Time vs Requests Count')
+    plt.xlabel('Number of Packets')
+    plt.ylabel('Average Response Time (seconds)')
+    plt.grid(True)
+    plt.savefig(args.plot)
@@ -1,43 +1,44 @@
-import requests
-import time
-import matplotlib.pyplot as plt
+import argparse
+
+import loadgen
 
 # Configuration
 service_ip = "10.0.1.1"  # Replace with the IP your load balancer uses
 url = f"http://{service_ip}/"
-request_counts = [100,500,1000,5000]  
-throughputs = []  # List to store throughput values 
+request_counts = [100,500,1000,5000]
+
+parser = argparse.ArgumentParser(description="Throughput vs. number of requests")
+parser.add_argument('--url', default=url)
+parser.add_argument('--concurrency', type=int, default=8)
+parser.add_argument('--warmup', type=float, default=1.0, help="Seconds of warmup before each run")
+parser.add_argument('--out', default='throughput.csv', help="Results file (.csv or .json)")
+parser.add_argument('--plot', help="Also save a plot to this image file")
+args = parser.parse_args()
 
+results = []
 for num_requests in request_counts:
-    total_data_received = 0  
-    
-    # Measure throughput
-    start_time = time.time()
-    for _ in range(num_requests):
-        response = requests.get(url)
-        total_data_received += len(response.content)  # Add size of each response
-    end_time = time.time()
-
-    # Calculate throughput in Mbps
-    total_time = end_time - start_time
-    throughput_mbps = (total_data_received * 8) / (total_time * 1e6)  # Convert bytes to megabits
-    
-    # Store throughput value
-    throughputs.append(throughput_mbps)
-    
+    # Closed loop: as fast as the balancer lets `concurrency` clients go
+    result = loadgen.run(args.url, 'closed', args.concurrency, num_requests,
+                         warmup=args.warmup)
+    results.append(result)
+
     print(f"Packet count: {num_requests}")
-    print(f"Total data received: {total_data_received} bytes")
-    print(f"Total time taken: {total_time} seconds")
-    print(f"Throughput: {throughput_mbps} Mbps")
+    print(f"Total data received: {result['bytes']} bytes")
+    print(f"Total time taken: {result['elapsed']} seconds")
+    print(f"Throughput: {result['throughput_mbps']} Mbps ({result['throughput_rps']:.1f} requests/s)")
     print()
 
-# Plot the results
-plt.figure(figsize=(10, 6))
-plt.plot(request_counts, throughputs, marker='o')
-plt.xlabel('Number of Packets')
-plt.ylabel('Throughput (Mbps)')
-plt.title('Throughput vs. Number of Requests')
-plt.grid(True)
-plt.show()
+loadgen.write_results(results, args.out)
 
+if args.plot:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
+    plt.figure(figsize=(10, 6))
+    plt.plot(request_counts, [r['throughput_mbps'] for r in results], marker='o')
+    plt.xlabel('Number of Packets')
+    plt.ylabel('Throughput (Mbps)')
+    plt.title('Throughput vs. Number of Requests')
+    plt.grid(True)
+    plt.savefig(args.plot)
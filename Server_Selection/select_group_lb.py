@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+
+'''
+Server load balancing in the switch with an OpenFlow 1.3 select group.
+
+This is the Ryu counterpart of the POX ip_loadbalancer.  Instead of the
+controller picking a server for every new connection, TCP traffic to the
+service IP is sent to a select group with one bucket per live server; the
+switch hashes each connection onto a bucket, and the bucket rewrites the
+destination MAC/IP and outputs to the server.  Bucket weights are the same
+weights the weighted round-robin balancer uses.
+
+The controller only deals with liveness: it ARPs every server each probe
+interval, and when a server comes up or goes down the group is modified.
+
+Tables:
+  0: balancing (to the group, and rewriting replies back to the service IP)
+  1: plain MAC learning
+
+Run it with:
+  ryu-manager select_group_lb.py
+'''
+
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import inet
+from ryu.lib import hub
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import arp
+from ryu.lib.packet import ether_types
+
+SERVICE_IP = '10.0.1.1'
+SERVICE_MAC = '00:00:00:00:01:01'
+SERVERS = ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4', '10.0.0.5']
+WEIGHTS = [5, 4, 3, 2, 1]  # Same as --weights for weighted_round_robin
+DPID = None  # Balance on the first switch that connects
+
+PROBE_INTERVAL = 1.0  # Seconds between ARP rounds
+ARP_TIMEOUT = 3.0  # No reply for this long and the server is down
+
+GROUP_ID = 1
+LB_TABLE = 0
+L2_TABLE = 1
+
+
+class SelectGroupLB(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(SelectGroupLB, self).__init__(*args, **kwargs)
+        self.weights = dict(zip(SERVERS, WEIGHTS))
+        self.datapath = None
+        self.live_servers = {}  # IP -> (MAC, port)
+        self.last_reply = {}  # IP -> time of last ARP reply
+        self.mac_to_port = {}
+        self.group_added = False
+        self.prober = None
+
+    def add_flow(self, datapath, table_id, priority, match, inst):
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id,
+                                priority=priority, match=match,
+                                instructions=inst)
+        datapath.send_msg(mod)
+
+    def update_group(self):
+        ''' Make the select group match the live servers '''
+        datapath = self.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        buckets = []
+        for ip in SERVERS:
+            if ip not in self.live_servers:
+                continue
+            mac, port = self.live_servers[ip]
+            actions = [parser.OFPActionSetField(eth_dst=mac),
+                       parser.OFPActionSetField(ipv4_dst=ip),
+                       parser.OFPActionOutput(port)]
+            buckets.append(parser.OFPBucket(weight=self.weights.get(ip, 1),
+                                            watch_port=ofproto.OFPP_ANY,
+                                            watch_group=ofproto.OFPG_ANY,
+                                            actions=actions))
+
+        command = ofproto.OFPGC_MODIFY if self.group_added else ofproto.OFPGC_ADD
+        req = parser.OFPGroupMod(datapath, command, ofproto.OFPGT_SELECT,
+                                 GROUP_ID, buckets)
+        datapath.send_msg(req)
+        self.group_added = True
+        self.logger.info(f"Select group now has {len(buckets)} servers: {sorted(self.live_servers)}")
+
+    def install_balancing(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        # ARP comes to us: we answer for the service IP and hear probe replies
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_ARP)
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        self.add_flow(datapath, LB_TABLE, 200, match, inst)
+
+        # New and old connections to the service IP go through the group
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                ip_proto=inet.IPPROTO_TCP, ipv4_dst=SERVICE_IP)
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                             [parser.OFPActionGroup(GROUP_ID)])]
+        self.add_flow(datapath, LB_TABLE, 100, match, inst)
+
+        # Replies from the servers look like they come from the service IP
+        for ip in SERVERS:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                    ip_proto=inet.IPPROTO_TCP, ipv4_src=ip)
+            actions = [parser.OFPActionSetField(eth_src=SERVICE_MAC),
+                       parser.OFPActionSetField(ipv4_src=SERVICE_IP)]
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions),
+                    parser.OFPInstructionGotoTable(L2_TABLE)]
+            self.add_flow(datapath, LB_TABLE, 100, match, inst)
+
+        # Everything else is just switched
+        inst = [parser.OFPInstructionGotoTable(L2_TABLE)]
+        self.add_flow(datapath, LB_TABLE, 0, parser.OFPMatch(), inst)
+
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        self.add_flow(datapath, L2_TABLE, 0, parser.OFPMatch(), inst)
+
+    def send_arp(self, datapath, opcode, src_mac, src_ip, dst_mac, dst_ip, out_port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        pkt = packet.Packet()
+        eth_dst = 'ff:ff:ff:ff:ff:ff' if opcode == arp.ARP_REQUEST else dst_mac
+        pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP,
+                                           dst=eth_dst, src=src_mac))
+        pkt.add_protocol(arp.arp(opcode=opcode, src_mac=src_mac, src_ip=src_ip,
+                                 dst_mac=dst_mac, dst_ip=dst_ip))
+        pkt.serialize()
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(out_port)],
+                                  data=pkt.data)
+        datapath.send_msg(out)
+
+    def probe_loop(self):
+        ''' ARP every server each round; drop the ones that stopped answering '''
+        while True:
+            datapath = self.datapath
+            if datapath is None:
+                # Switch disconnected; wait for it to come back
+                hub.sleep(PROBE_INTERVAL)
+                continue
+            now = time.time()
+            for ip in SERVERS:
+                self.send_arp(datapath, arp.ARP_REQUEST, SERVICE_MAC, SERVICE_IP,
+                              '00:00:00:00:00:00', ip, datapath.ofproto.OFPP_FLOOD)
+
+            down = [ip for ip in self.live_servers
+                    if now - self.last_reply.get(ip, 0) > ARP_TIMEOUT]
+            for ip in down:
+                self.logger.warning(f"Server {ip} down")
+                del self.live_servers[ip]
+            if down:
+                self.update_group()
+
+            hub.sleep(PROBE_INTERVAL)
+
+    def handle_arp(self, datapath, in_port, arp_pkt):
+        if arp_pkt.opcode == arp.ARP_REPLY and arp_pkt.src_ip in self.weights \
+                and arp_pkt.dst_ip == SERVICE_IP:
+            ip = arp_pkt.src_ip
+            self.last_reply[ip] = time.time()
+            if self.live_servers.get(ip) != (arp_pkt.src_mac, in_port):
+                self.logger.info(f"Server {ip} up")
+                self.live_servers[ip] = (arp_pkt.src_mac, in_port)
+                self.update_group()
+            return True
+
+        if arp_pkt.opcode == arp.ARP_REQUEST and arp_pkt.dst_ip == SERVICE_IP:
+            self.send_arp(datapath, arp.ARP_REPLY, SERVICE_MAC, SERVICE_IP,
+                          arp_pkt.src_mac, arp_pkt.src_ip, in_port)
+            return True
+
+        return False
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def _switch_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        if self.datapath is not None or (DPID is not None and datapath.id != DPID):
+            self.logger.warning(f"Ignoring switch {datapath.id}")
+            return
+
+        self.logger.info(f"Load balancing on switch {datapath.id}")
+        self.datapath = datapath
+        self.install_balancing(datapath)
+        self.update_group()
+        if self.prober is None:
+            self.prober = hub.spawn(self.probe_loop)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        ''' The switch went away; it gets its rules and group again when it's back '''
+        if ev.datapath is not self.datapath:
+            return
+        self.logger.warning(f"Switch {ev.datapath.id} disconnected")
+        self.datapath = None
+        self.group_added = False
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        msg = ev.msg
+        datapath = msg.datapath
+        if datapath is not self.datapath:
+            return
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        in_port = msg.match['in_port']
+
+        pkt = packet.Packet(msg.data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        self.mac_to_port[eth.src] = in_port
+
+        arp_pkt = pkt.get_protocol(arp.arp)
+        if arp_pkt is not None and self.handle_arp(datapath, in_port, arp_pkt):
+            return
+
+        # Plain MAC learning for everything else
+        if eth.dst in self.mac_to_port:
+            out_port = self.mac_to_port[eth.dst]
+            match = parser.OFPMatch(eth_dst=eth.dst)
+            actions = [parser.OFPActionOutput(out_port)]
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+            self.add_flow(datapath, L2_TABLE, 1, match, inst)
+        else:
+            out_port = ofproto.OFPP_FLOOD
+
+        data = None
+        if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+            data = msg.data
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                  in_port=in_port,
+                                  actions=[parser.OFPActionOutput(out_port)],
+                                  data=data)
+        datapath.send_msg(out)